@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+''' reproducible timings of the trade history hot paths on synthetic data
+
+    ./benchmark.py --sizes 10k,1m -o bench.json
+    ./benchmark.py --sizes 10k,1m --compare bench.json
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import urllib.request
+import logging as log
+
+import numpy as np
+
+import mftl
+import fake_exchange
+from http_transport import HttpTransport
+from history_store import SegmentStore, merge_trades
+from indicators import Vema, HistoryVema
+from trade_columns import TradeColumns, FIELDS, BUY, SELL
+
+SIZES = {'10k': 10 ** 4, '1m': 10 ** 6, '50m': 50 * 10 ** 6}
+
+
+def synthetic_trades(n, seed=42, t_end=1500000000., interval=10.):
+    ''' @n trade dicts like TradeHistory.data() holds: a random walk with
+        trades every @interval seconds on average '''
+    rnd = random.Random(seed)
+    t = t_end - n * interval
+    rate = 0.01
+    result = []
+    for _ in range(n):
+        t += rnd.expovariate(1. / interval)
+        rate *= 1. + rnd.gauss(0., 0.001)
+        amount = rnd.expovariate(1.)
+        result.append({'time': t, 'rate': rate, 'amount': amount,
+                       'total': amount * rate,
+                       'type': 'buy' if rnd.random() < .5 else 'sell'})
+    return result
+
+
+def synthetic_columns(n, seed=42, t_end=1500000000., interval=10.):
+    ''' same as synthetic_trades() but generated as columns directly - for
+        sizes which would not fit into memory as dicts '''
+    rng = np.random.default_rng(seed)
+    time_ = t_end - n * interval + np.cumsum(rng.exponential(interval, n))
+    rate = 0.01 * np.cumprod(1. + rng.normal(0., 0.001, n))
+    amount = rng.exponential(1., n)
+    side = np.where(rng.random(n) < .5, BUY, SELL).astype(np.int8)
+    return TradeColumns(time_, rate, amount, amount * rate, side)
+
+
+class SyntheticApi:
+    ''' stands in for mftl.px.PxApi: answers trade history requests with
+        a fixed number of new synthetic trades in Poloniex format '''
+    def __init__(self, trades_per_call=300, seed=43):
+        self._trades_per_call = trades_per_call
+        self._rnd = random.Random(seed)
+        self._id = 0
+
+    def get_trade_history(self, *args, **kwargs):
+        now = time.time()
+        result = []
+        for i in range(self._trades_per_call):
+            self._id += 1
+            rate = 0.01 * (1. + self._rnd.gauss(0., 0.001))
+            amount = self._rnd.expovariate(1.)
+            result.append({
+                'globalTradeID': self._id, 'tradeID': self._id,
+                'date': time.strftime(
+                    '%Y-%m-%d %H:%M:%S', time.gmtime(now - i)),
+                'type': 'buy' if self._rnd.random() < .5 else 'sell',
+                'rate': '%.8f' % rate, 'amount': '%.8f' % amount,
+                'total': '%.8f' % (rate * amount)})
+        return result
+
+
+def timed(fn, repeat):
+    ''' best of @repeat runs in seconds '''
+    result = None
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        fn()
+        duration = time.perf_counter() - t1
+        result = duration if result is None else min(result, duration)
+    return result
+
+
+def create_trade_history(trades):
+    th = mftl.TradeHistory('BTC_BENCH', step_size_sec=3600)
+    merge_trades(th, trades)
+    return th
+
+
+def bench_dicts(n, repeat):
+    ''' benchmarks on list-of-dict histories (TradeHistory and friends) '''
+    trades = synthetic_trades(n)
+    totals = [t['total'] for t in trades]
+    amounts = [t['amount'] for t in trades]
+    th = create_trade_history(trades)
+    result = {}
+    result['TradeHistory.save'] = timed(th.save, repeat)
+    result['TradeHistory.load'] = timed(
+        lambda: mftl.TradeHistory('BTC_BENCH', step_size_sec=3600).load(),
+        repeat)
+    result['TradeHistory.fetch_next'] = timed(
+        lambda: th.fetch_next(api=SyntheticApi()), repeat)
+    result['TradeHistory.rate_buckets'] = timed(
+        lambda: th.rate_buckets(5 * 60), repeat)
+    result['TradeHistory.get_plot_data'] = timed(
+        lambda: th.get_plot_data(0.005), repeat)
+    result['mftl.vema'] = timed(
+        lambda: mftl.vema(totals, amounts, 0.005), repeat)
+    result['Vema.update'] = timed(
+        lambda: Vema(0.005).update(totals, amounts), repeat)
+
+    vema = HistoryVema(create_trade_history(trades), 0.005)
+    vema.update()
+    result['HistoryVema.update(no new trades)'] = timed(vema.update, repeat)
+
+    def save_store():
+        store = SegmentStore('BTC_BENCH', directory='store-%d' % time.time_ns())
+        store.save(trades)
+        return store
+    result['SegmentStore.save'] = timed(save_store, repeat)
+    store = save_store()
+    result['SegmentStore.trades'] = timed(lambda: list(store.trades()), repeat)
+    result['TradeColumns.from_trades'] = timed(
+        lambda: TradeColumns.from_trades(trades), repeat)
+    return result
+
+
+def bench_columns(n, repeat):
+    ''' benchmarks on columnar histories - these scale to 50M trades '''
+    columns = synthetic_columns(n)
+    result = {}
+    result['TradeColumns.save'] = timed(lambda: columns.save('columns'), repeat)
+    result['TradeColumns.load(mmap)'] = timed(
+        lambda: TradeColumns.load('columns'), repeat)
+    result['TradeColumns.load'] = timed(
+        lambda: TradeColumns.load('columns', mmap=False), repeat)
+    result['TradeColumns.buckets(300)'] = timed(
+        lambda: TradeColumns(*(getattr(columns, f) for f, _ in FIELDS)
+                             ).buckets(300), repeat)
+    cached = TradeColumns(*(getattr(columns, f) for f, _ in FIELDS))
+    cached.buckets(300)
+    result['TradeColumns.buckets(3600, cached 300)'] = timed(
+        lambda: cached.buckets(300).aggregate(3600), repeat)
+    return result
+
+
+def bench_http(repeat, requests=50, connect_latency=0.02):
+    ''' ticker requests against a local fake_exchange which delays each new
+        connection by @connect_latency (think TCP + TLS handshake) '''
+    ticker = {'BTC_%03d' % i: {'last': '0.01', 'percentChange': '0.1'}
+              for i in range(100)}
+    os.makedirs('recordings', exist_ok=True)
+    open(fake_exchange.recording_path('recordings', 'public/returnTicker'),
+         'w').write(json.dumps(ticker))
+    server = fake_exchange.start_server(
+        0, 'recordings', connect_latency=connect_latency)
+    url = 'http://127.0.0.1:%d/public?command=returnTicker' % (
+        server.server_address[1])
+
+    def with_urlopen():
+        for _ in range(requests):
+            urllib.request.urlopen(url).read()
+
+    def with_transport():
+        transport = HttpTransport()
+        for _ in range(requests):
+            transport.request(url)
+        transport.close()
+
+    try:
+        return {'urlopen(returnTicker x%d)' % requests: timed(with_urlopen, repeat),
+                'HttpTransport(returnTicker x%d)' % requests: timed(
+                    with_transport, repeat)}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, repeat, max_dicts, http=False):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            for size in sizes:
+                n = SIZES[size]
+                log.info('run benchmarks with %s trades..', size)
+                timings = bench_columns(n, repeat)
+                if n <= max_dicts:
+                    timings.update(bench_dicts(n, repeat))
+                else:
+                    log.info('skip list-of-dict benchmarks for %s trades', size)
+                for name, duration in timings.items():
+                    results.setdefault(name, {})[size] = duration
+            if http:
+                log.info('run HTTP transport benchmarks..')
+                for name, duration in bench_http(repeat).items():
+                    results.setdefault(name, {})['http'] = duration
+        finally:
+            os.chdir(cwd)
+    return {'revision': git_revision(),
+            'time': time.time(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'repeat': repeat,
+            'results': results}
+
+
+def print_results(report, baseline=None):
+    base = baseline['results'] if baseline else {}
+    print('revision: %s%s' % (
+        report['revision'],
+        ' (compared to %s)' % baseline['revision'] if baseline else ''))
+    for name, timings in sorted(report['results'].items()):
+        for size, duration in timings.items():
+            line = '%-42s %4s %10.4fs' % (name, size, duration)
+            if size in base.get(name, {}):
+                line += ' %+7.1f%%' % (100 * (duration / base[name][size] - 1))
+            print(line)
+
+
+def get_args() -> dict:
+    parser = argparse.ArgumentParser(description='benchmark')
+    parser.add_argument("-v", "--verbose", action='store_true')
+    parser.add_argument("-s", "--sizes", default='10k,1m',
+                        help='comma separated, any of %s' % ','.join(SIZES))
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("--max-dicts", type=int, default=SIZES['1m'],
+                        help='max number of trades held as list of dicts')
+    parser.add_argument("--http", action='store_true',
+                        help='also compare HTTP transports on a fake exchange')
+    parser.add_argument("-o", "--output", help='write results as JSON')
+    parser.add_argument("--compare", help='JSON results of an earlier run')
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    log.basicConfig(level=log.DEBUG if args.verbose else log.INFO)
+    sizes = args.sizes.lower().split(',')
+    for size in sizes:
+        if size not in SIZES:
+            sys.exit('unknown size %r' % size)
+    report = run(sizes, args.repeat, args.max_dicts, args.http)
+    print_results(
+        report, json.loads(open(args.compare).read()) if args.compare else None)
+    if args.output:
+        open(args.output, 'w').write(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
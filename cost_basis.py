@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import collections
+import threading
+
+from order_journal import trade_time
+
+FIFO, AVERAGE = 'fifo', 'average'
+
+
+class Position:
+    ''' holdings of one market's coin as far as its trades tell '''
+    def __init__(self):
+        self.amount = 0.
+        self.cost = 0.
+        self.realised = 0.
+        self.last_buy_rate = None
+        self.last_time = None
+        # (amount, cost) of each buy not sold yet (FIFO only)
+        self.lots = collections.deque()
+
+
+class CostBasis:
+    ''' incremental cost-basis and P&L per market: each trade gets applied
+        exactly once, so all lookups are O(1) regardless of how long the
+        trading history is. @method is FIFO or AVERAGE. '''
+    def __init__(self, method=FIFO):
+        if method not in (FIFO, AVERAGE):
+            raise ValueError('unknown cost basis method %r' % method)
+        self._method = method
+        self._lock = threading.Lock()
+        self._positions = {}
+
+    def method(self):
+        return self._method
+
+    def update(self, trades, journal=None):
+        ''' applies @trades (journal entries carrying 'market'). A market
+            which gets a trade older than the ones applied already is
+            rebuilt from @journal '''
+        by_market = {}
+        for t in trades:
+            by_market.setdefault(t['market'], []).append(t)
+        with self._lock:
+            for market, new in by_market.items():
+                new.sort(key=trade_time)
+                position = self._positions.get(market)
+                if (position and position.last_time is not None and
+                        trade_time(new[0]) < position.last_time):
+                    if journal is None:
+                        raise ValueError('%s: trades out of order' % market)
+                    position, new = None, journal.entries(market)
+                if position is None:
+                    position = self._positions[market] = Position()
+                for t in new:
+                    self._apply(position, t)
+
+    def _apply(self, position, trade):
+        amount = float(trade['amount'])
+        total = float(trade['total'])
+        fee = float(trade.get('fee', 0.))
+        position.last_time = trade_time(trade)
+        if trade['type'] == 'buy':
+            # the fee gets taken from the bought coins
+            amount *= 1. - fee
+            position.amount += amount
+            position.cost += total
+            position.last_buy_rate = float(trade['rate'])
+            if self._method == FIFO:
+                position.lots.append((amount, total))
+            return
+
+        # sell: the fee gets taken from the proceeds
+        proceeds = total * (1. - fee)
+        sold = min(amount, position.amount)
+        if self._method == FIFO:
+            cost, remaining = 0., sold
+            while remaining > 0 and position.lots:
+                lot_amount, lot_cost = position.lots[0]
+                if lot_amount <= remaining:
+                    position.lots.popleft()
+                    cost += lot_cost
+                    remaining -= lot_amount
+                else:
+                    part = lot_cost * remaining / lot_amount
+                    position.lots[0] = (lot_amount - remaining, lot_cost - part)
+                    cost += part
+                    remaining = 0.
+        else:
+            cost = (position.cost * sold / position.amount
+                    if position.amount > 0 else 0.)
+        # coins we have no buy for (e.g. deposits) count as free
+        position.realised += proceeds - cost
+        position.amount -= sold
+        position.cost = max(0., position.cost - cost)
+        if position.amount <= 0:
+            position.amount, position.cost = 0., 0.
+            position.lots.clear()
+
+    def markets(self):
+        with self._lock:
+            return set(self._positions)
+
+    def amount(self, market):
+        with self._lock:
+            p = self._positions.get(market)
+            return p.amount if p else 0.
+
+    def cost(self, market):
+        ''' what the coins still held have cost (in the base currency) '''
+        with self._lock:
+            p = self._positions.get(market)
+            return p.cost if p else 0.
+
+    def realised(self, market):
+        with self._lock:
+            p = self._positions.get(market)
+            return p.realised if p else 0.
+
+    def unrealised(self, market, rate):
+        ''' gain of the coins still held when sold at @rate '''
+        with self._lock:
+            p = self._positions.get(market)
+            return p.amount * rate - p.cost if p else 0.
+
+    def last_buy_rate(self, market):
+        with self._lock:
+            p = self._positions.get(market)
+            return p.last_buy_rate if p else None
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    ''' reduces (@x, @y) to @threshold points using the 'largest triangle
+        three buckets' algorithm which keeps the visual shape of a series,
+        see https://github.com/sveinn-steinarsson/flot-downsample '''
+    x, y = np.asarray(x, np.float64), np.asarray(y, np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:avg_end].mean()
+        avg_y = y[end:avg_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) -
+                      (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+    return x[indices], y[indices]
+
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+''' local stand-in for the Poloniex HTTP API: replays recorded responses
+    so transport latency and retry behaviour can be tested offline. A
+    WebSocket connection gets the recorded push feed (feed.jsonl, written
+    by PushFeed(record=..)) and gets closed at its end.
+
+    ./fake_exchange.py --record returnTicker,returnCurrencies
+    ./fake_exchange.py -p 8081 --connect-latency .2 --error-rate .1
+'''
+
+import os
+import json
+import gzip
+import time
+import random
+import argparse
+import threading
+import http.server
+import urllib.parse
+import logging as log
+
+from http_transport import HttpTransport, endpoint
+from push_feed import WebSocket
+
+URL = 'https://poloniex.com'
+
+
+def recording_path(directory, name):
+    return os.path.join(directory, name.replace('/', '.') + '.json')
+
+
+class FakeExchange(http.server.BaseHTTPRequestHandler):
+    ''' answers GET /public?command=X and POST /tradingApi (command in the
+        body) with the recording of that endpoint. Optionally delays new
+        connections and requests and fails a share of them '''
+    protocol_version = 'HTTP/1.1'
+    # headers and body get written separately - don't wait for ACKs
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # stands in for the TCP and TLS handshake of a new connection
+        time.sleep(self.server.connect_latency)
+
+    def do_GET(self):
+        if self.headers.get('Upgrade', '').lower() == 'websocket':
+            self._replay_feed()
+            return
+        self._answer(None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._answer(self.rfile.read(length))
+
+    def _answer(self, data):
+        server = self.server
+        time.sleep(server.latency)
+        name = endpoint(self.path, data)
+        if server.random.random() < server.error_rate:
+            self._send(503, b'{"error": "fake exchange is overloaded"}')
+            return
+        try:
+            content = open(recording_path(server.directory, name), 'rb').read()
+        except FileNotFoundError:
+            self._send(404, b'{"error": "no recording for %s"}' % name.encode())
+            return
+        self._send(200, content)
+
+    def _replay_feed(self):
+        ws = WebSocket.accept(self)
+        try:
+            with open(os.path.join(self.server.directory, 'feed.jsonl')) as f:
+                for line in f:
+                    delay, message = json.loads(line)
+                    time.sleep(delay / self.server.feed_speed)
+                    ws.send(message)
+        except FileNotFoundError:
+            log.warning('no feed recording in %r', self.server.directory)
+        except OSError:
+            pass
+        finally:
+            ws.close()
+
+    def _send(self, status, content):
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if compress:
+            content = gzip.compress(content)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, fmt, *args):
+        log.debug(fmt, *args)
+
+
+def start_server(port, directory, latency=0., connect_latency=0.,
+                 error_rate=0., seed=None, feed_speed=1.):
+    ''' runs a FakeExchange in a daemon thread - returns the server (its
+        port is server.server_address[1] if @port is 0) '''
+    http.server.ThreadingHTTPServer.allow_reuse_address = True
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), FakeExchange)
+    server.daemon_threads = True
+    server.directory = directory
+    server.latency = latency
+    server.connect_latency = connect_latency
+    server.error_rate = error_rate
+    server.feed_speed = feed_speed
+    server.random = random.Random(seed)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def record(commands, directory, url=URL):
+    ''' stores the current answers of public @commands in @directory '''
+    os.makedirs(directory, exist_ok=True)
+    transport = HttpTransport()
+    for command in commands:
+        request = '%s/public?%s' % (url, urllib.parse.urlencode(
+            {'command': command}))
+        content = transport.request(request)
+        open(recording_path(directory, endpoint(request)), 'wb').write(content)
+        log.info('recorded %s (%d bytes)', command, len(content))
+
+
+def get_args() -> dict:
+    parser = argparse.ArgumentParser(description='fake_exchange')
+    parser.add_argument("-v", "--verbose", action='store_true')
+    parser.add_argument("-d", "--directory", default='recordings')
+    parser.add_argument("-p", "--port", type=int, default=8081)
+    parser.add_argument("--record",
+                        help='comma separated public commands to record')
+    parser.add_argument("--latency", type=float, default=0.,
+                        help='seconds added to each request')
+    parser.add_argument("--connect-latency", type=float, default=0.,
+                        help='seconds added to each new connection')
+    parser.add_argument("--error-rate", type=float, default=0.,
+                        help='share of requests answered with 503')
+    parser.add_argument("--feed-speed", type=float, default=1.,
+                        help='replay the push feed N times as fast')
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    log.basicConfig(level=log.DEBUG if args.verbose else log.INFO)
+    if args.record:
+        record(args.record.split(','), args.directory)
+        return
+    server = start_server(args.port, args.directory, args.latency,
+                          args.connect_latency, args.error_rate,
+                          feed_speed=args.feed_speed)
+    print('replaying %r on port %d' % (args.directory, args.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
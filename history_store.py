@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import heapq
+import bisect
+import struct
+import threading
+import logging as log
+
+# compact binary trade record: trade id (-1 if unknown), time, rate,
+# amount, total, side (1=buy)
+RECORD = struct.Struct('<qddddb')
+
+
+def pack_trades(trades):
+    return b''.join(
+        RECORD.pack(int(t.get('tradeID', -1)), t['time'],
+                    t['rate'] if 'rate' in t else t['total'] / t['amount'],
+                    t['amount'], t['total'], t['type'] == 'buy')
+        for t in trades)
+
+
+def trade_key(trade):
+    ''' identifies a trade - by its id if we know it, otherwise by what
+        it is (timestamps have a resolution of one second only) '''
+    if 'tradeID' in trade:
+        return int(trade['tradeID'])
+    return (trade['time'], float(trade['amount']), float(trade['total']),
+            trade['type'])
+
+
+def unpack_trades(data):
+    result = []
+    for i, t, r, a, tot, side in RECORD.iter_unpack(data):
+        trade = {'time': t, 'rate': r, 'amount': a, 'total': tot,
+                 'type': 'buy' if side else 'sell'}
+        if i >= 0:
+            trade['tradeID'] = i
+        result.append(trade)
+    return result
+
+
+def complete_trade(trade):
+    ''' returns @trade with the fields TradeHistory has for each trade '''
+    result = dict(trade)
+    result['time'] = float(result['time'])
+    result.setdefault('rate', float(result['total']) / float(result['amount']))
+    result.setdefault('date', time.strftime(
+        '%Y-%m-%d %H:%M:%S', time.gmtime(result['time'])))
+    return result
+
+
+def merge_trades(trade_history, trades):
+    ''' adds those of @trades to @trade_history which it doesn't have yet
+        (see trade_key()) and returns how many these were. This is the
+        only place which changes TradeHistory.data() from outside. '''
+    new = {}
+    for t in trades:
+        t = complete_trade(t)
+        new.setdefault(trade_key(t), t)
+    if not new:
+        return 0
+    # data() is the live, time ordered list of trades
+    data = trade_history.data()
+    i = bisect.bisect_left(data, min(t['time'] for t in new.values()),
+                           key=lambda t: t['time'])
+    for t in data[i:]:
+        new.pop(trade_key(t), None)
+    if not new:
+        return 0
+    added = sorted(new.values(), key=lambda t: t['time'])
+    if not data or added[0]['time'] >= data[-1]['time']:
+        data.extend(added)
+    else:
+        data[i:] = list(heapq.merge(data[i:], added, key=lambda t: t['time']))
+    return len(added)
+
+
+class SegmentStore:
+    ''' append-only on-disk trade history of one market
+
+        New trades are written to a new segment file (one JSON record per
+        line) which gets fsync'ed before the index is atomically replaced.
+        A crash while saving thus leaves at most an orphaned segment file
+        but never a broken archive. compact() merges all segments into one.
+    '''
+    def __init__(self, market, directory='cache'):
+        self._market = market
+        self._directory = os.path.join(directory, 'history-%s' % market)
+        os.makedirs(self._directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._index_file = os.path.join(self._directory, 'index.json')
+        try:
+            self._index = json.loads(open(self._index_file).read())
+        except FileNotFoundError:
+            self._index = {'next': 0, 'segments': []}
+
+    def name(self):
+        return self._market
+
+    def directory(self):
+        return self._directory
+
+    def segments(self):
+        with self._lock:
+            return list(self._index['segments'])
+
+    def count(self):
+        return sum(s['count'] for s in self.segments())
+
+    def first_time(self):
+        return min((s['first'] for s in self.segments()), default=None)
+
+    def last_time(self):
+        return max((s['last'] for s in self.segments()), default=None)
+
+    def last_modified(self):
+        return os.path.getmtime(self._index_file) if self.segments() else 0.
+
+    def delta(self, trades):
+        ''' returns the trades from @trades (sorted by time) which are not
+            stored yet - i.e. older or newer than everything we have or
+            unknown ones from the first or last second we have '''
+        first, last = self.first_time(), self.last_time()
+        if first is None:
+            return list(trades)
+        i = 0
+        while i < len(trades) and trades[i]['time'] < first:
+            i += 1
+        j = len(trades)
+        while j > i and trades[j - 1]['time'] > last:
+            j -= 1
+        boundary = [t for t in trades[i:j] if t['time'] in (first, last)]
+        if boundary:
+            known = {trade_key(t) for t in self.trades(first, first)}
+            known.update(trade_key(t) for t in self.trades(last, last))
+            boundary = [t for t in boundary if trade_key(t) not in known]
+        return list(trades[:i]) + boundary + list(trades[j:])
+
+    def append(self, trades):
+        if not trades:
+            return 0
+        trades = sorted(trades, key=lambda t: t['time'])
+        with self._lock:
+            filename = 'seg-%06d.jsonl' % self._index['next']
+            self._write_segment(filename, trades)
+            self._index['next'] += 1
+            self._index['segments'].append({
+                'file': filename, 'count': len(trades),
+                'first': trades[0]['time'], 'last': trades[-1]['time']})
+            self._write_index()
+        return len(trades)
+
+    def save(self, trades):
+        ''' persists only the part of @trades which is not stored yet '''
+        return self.append(self.delta(trades))
+
+    @staticmethod
+    def _read_segment(f):
+        with f:
+            for line in f:
+                yield json.loads(line)
+
+    def trades(self, t_from=None, t_to=None):
+        ''' yields all stored trades in [@t_from, @t_to] ordered by time '''
+        with self._lock:
+            # open all files now - compact() might remove them later
+            files = [open(os.path.join(self._directory, s['file']))
+                     for s in self._index['segments']
+                     if (t_from is None or s['last'] >= t_from) and
+                        (t_to is None or s['first'] <= t_to)]
+        # segments are sorted but may interleave (old and new trades)
+        for t in heapq.merge(*map(self._read_segment, files),
+                             key=lambda t: t['time']):
+            if t_from is not None and t['time'] < t_from: continue
+            if t_to is not None and t['time'] > t_to: break
+            yield t
+
+    def compact(self):
+        with self._lock:
+            if len(self._index['segments']) < 2:
+                return
+            old_files = {s['file'] for s in self._index['segments']}
+            trades = list(self.trades())
+            filename = 'seg-%06d.jsonl' % self._index['next']
+            self._write_segment(filename, trades)
+            self._index['next'] += 1
+            self._index['segments'] = [{
+                'file': filename, 'count': len(trades),
+                'first': trades[0]['time'], 'last': trades[-1]['time']}]
+            self._write_index()
+            # remove merged and orphaned (crashed before indexing) segments
+            for f in os.listdir(self._directory):
+                if f.startswith('seg-') and f != filename:
+                    if f not in old_files:
+                        log.warning('remove orphaned segment %r', f)
+                    os.remove(os.path.join(self._directory, f))
+
+    def columns(self):
+        ''' returns the stored trades as (memory mapped) TradeColumns,
+            the column files are rebuilt if the store has changed '''
+        from trade_columns import TradeColumns
+        directory = os.path.join(self._directory, 'columns')
+        with self._lock:
+            # every append() and compact() uses a new segment number
+            source = [self._index['next'], self.count()]
+            manifest = TradeColumns.manifest(directory)
+            if not manifest or manifest['source'] != source:
+                TradeColumns.from_trades(list(self.trades())).save(
+                    directory, source=source)
+        return TradeColumns.load(directory)
+
+    def _write_segment(self, filename, trades):
+        with open(os.path.join(self._directory, filename), 'w') as f:
+            for t in trades:
+                f.write(json.dumps(t))
+                f.write('\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_index(self):
+        tmp_file = self._index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(json.dumps(self._index))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self._index_file)
+
+
+def bucket_trades(trades, interval):
+    ''' aggregates a time ordered stream of trades into OHLC buckets of
+        @interval seconds without keeping more than one bucket in memory '''
+    bucket = None
+    for t in trades:
+        start = t['time'] - t['time'] % interval
+        rate = t['rate'] if 'rate' in t else t['total'] / t['amount']
+        if bucket is None or bucket['time'] != start:
+            if bucket is not None:
+                yield bucket
+            bucket = {'time': start, 'open': rate, 'high': rate, 'low': rate,
+                      'close': rate, 'amount': 0., 'total': 0., 'count': 0}
+        bucket['high'] = max(bucket['high'], rate)
+        bucket['low'] = min(bucket['low'], rate)
+        bucket['close'] = rate
+        bucket['amount'] += t['amount']
+        bucket['total'] += t['total']
+        bucket['count'] += 1
+    if bucket is not None:
+        yield bucket
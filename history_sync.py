@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import time
+import logging as log
+
+import http_transport
+from history_store import unpack_trades, merge_trades
+
+# ask again for markets the history server didn't have after that long
+MISSING_RETRY_SEC = 3600
+
+
+class HistorySyncClient:
+    ''' pulls trade history deltas from a running trading_history_server
+        so only the remaining gap has to be fetched from the exchange '''
+    def __init__(self, url, timeout=2., transport=None):
+        self._url = url.rstrip('/')
+        self._timeout = timeout
+        # no retries and no share of the exchange's rate limit: there is
+        # a fallback if the history server does not answer
+        self._transport = transport or http_transport.HttpTransport(tries=1)
+        self._missing = {}
+
+    def fetch_delta(self, market, t_from):
+        ''' returns all trades of @market from @t_from on - or nothing if
+            the server doesn't have @market '''
+        if time.time() - self._missing.get(market, 0.) < MISSING_RETRY_SEC:
+            return []
+        url = '%s/history/%s?from=%f&format=binary' % (
+            self._url, market, t_from)
+        try:
+            return unpack_trades(
+                self._transport.request(url, timeout=self._timeout))
+        except http_transport.HttpError as exc:
+            if exc.status != 404:
+                raise
+            log.info('history server does not have %r', market)
+            self._missing[market] = time.time()
+            return []
+
+
+def fetch_next(trade_history, client=None, max_age=48*3600, **kwargs):
+    ''' TradeHistory.fetch_next() which asks the history server (if
+        configured) before going to the exchange '''
+    synced = 0
+    if client:
+        t_from = (trade_history.last_time() if trade_history.count() else
+                  time.time() - max_age)
+        t1 = time.time()
+        try:
+            trades = client.fetch_delta(trade_history.name(), t_from)
+        except OSError as exc:
+            log.warning('could not sync %r from history server: %r',
+                        trade_history.name(), exc)
+            trades = []
+        synced = merge_trades(trade_history, trades)
+        log.debug('synced %d trades for %r from history server in %.3fs',
+                  synced, trade_history.name(), time.time() - t1)
+    return trade_history.fetch_next(**kwargs) or synced > 0
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import gzip
+import time
+import select
+import threading
+import contextlib
+import http.client
+import email.message
+import urllib.error
+import urllib.parse
+import urllib.request
+import urllib.response
+import logging as log
+
+from utils import RateLimiter, backoff, PRIVATE, MARKET
+from response_cache import ResponseCache
+
+# requests per second allowed by the exchange
+RATE = 6.
+CACHE_DIRECTORY = os.path.join('cache', 'responses')
+
+
+class HttpError(OSError):
+    ''' non-2xx answer - an OSError, so callers treating network errors
+        alike need no extra handling '''
+    def __init__(self, status, reason, url):
+        super().__init__('HTTP %d %s (%s)' % (status, reason, url))
+        self.status = status
+        self.reason = reason
+        self.url = url
+
+
+def endpoint(url, data=None):
+    ''' name of the API endpoint a request goes to - e.g.
+        'public/returnTicker' or 'tradingApi/returnBalances' '''
+    parsed = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qs(parsed.query)
+    if data:
+        query.update(urllib.parse.parse_qs(
+            data.decode() if isinstance(data, bytes) else data))
+    command = query.get('command', [None])[0]
+    path = parsed.path.strip('/')
+    return '%s/%s' % (path, command) if command else path
+
+
+def request_class(name):
+    ''' the request class (see utils) of API endpoint @name '''
+    return PRIVATE if name.startswith('tradingApi/') else MARKET
+
+
+def retryable(exc):
+    ''' whether a failed GET can be sent again - POSTs never are: they
+        carry the nonce they've been signed with, so the exchange would
+        reject the copy (or a newer request sent meanwhile) anyway '''
+    if isinstance(exc, HttpError):
+        return exc.status in (429, 500, 502, 503, 504)
+    return isinstance(exc, OSError)
+
+
+class HttpTransport:
+    ''' HTTP(S) client which keeps connections alive and re-uses them
+        across threads (up to @max_idle per host), asks for gzip'ed answers
+        and records timings per endpoint. Re-using a connection saves the
+        TCP and TLS handshake on every request after the first one.
+        All requests share @limiter (if given) and failed GETs get retried
+        with jittered exponential backoff up to @tries times. GET answers
+        are served from @cache while they are fresh. '''
+    # errors telling a kept-alive connection has been closed by the server
+    _STALE = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+              ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, timeout=10., max_idle=4, user_agent='mftl',
+                 limiter=None, tries=4, cache=None):
+        self._timeout = timeout
+        self._limiter = limiter
+        self._tries = tries
+        self._cache = cache
+        self._max_idle = max_idle
+        self._user_agent = user_agent
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._stats = {}
+        self._redirects = []
+        self._proxies = {}
+
+    def set_proxies(self, proxies: dict):
+        ''' @proxies: {'http': 'host:port', 'https': 'host:port'} - like
+            mftl.util.set_proxies() '''
+        with self._lock:
+            self._proxies = {
+                k: v if '://' in v else 'http://' + v
+                for k, v in (proxies or {}).items()}
+            self._close_idle()
+
+    def set_cache(self, cache):
+        self._cache = cache
+
+    def set_limiter(self, limiter):
+        self._limiter = limiter
+
+    def cache(self):
+        return self._cache
+
+    def redirect(self, prefix, target):
+        ''' sends requests for URLs starting with @prefix to @target instead
+            (e.g. to a fake_exchange server) '''
+        with self._lock:
+            self._redirects.append((prefix, target))
+
+    def request(self, url, data=None, headers=None, timeout=None,
+                priority=MARKET) -> bytes:
+        ''' GETs @url (or POSTs @data) and returns the (decompressed) body.
+            @priority is one of the request classes in utils - POSTs are
+            always PRIVATE, so they leave in the order they come in, and
+            are sent only once '''
+        name = endpoint(url, data)
+        cache = self._cache if data is None else None
+        if data is not None:
+            priority = PRIVATE
+        if cache:
+            body = cache.get(name, url)
+            if body is not None:
+                return body
+
+        def attempt():
+            if self._limiter:
+                self._limiter.acquire(priority)
+            return self._request(url, data, headers, timeout)
+        try:
+            body = backoff(
+                attempt, errors=(OSError,),
+                tries=self._tries if data is None else 1,
+                retry_if=retryable, name=name)
+        except OSError as exc:
+            stale = (cache.get(name, url, max_age=float('inf'))
+                     if cache and cache.serve_stale() else None)
+            if stale is None:
+                raise
+            log.warning('%s failed (%r) - use cached answer', name, exc)
+            return stale
+        if cache:
+            cache.put(name, url, body)
+        return body
+
+    def _request(self, url, data, headers, timeout):
+        for prefix, target in self._redirects:
+            if url.startswith(prefix):
+                url = target + url[len(prefix):]
+                break
+        if isinstance(data, str):
+            data = data.encode()
+        parsed = urllib.parse.urlsplit(url)
+        key = (parsed.scheme, parsed.netloc)
+        request_headers = {'Accept-Encoding': 'gzip',
+                           'User-Agent': self._user_agent}
+        if data is not None:
+            request_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        request_headers.update(headers or {})
+        target = parsed.path or '/'
+        if parsed.query:
+            target += '?' + parsed.query
+        if parsed.scheme == 'http' and 'http' in self._proxies:
+            # plain HTTP proxies take the absolute URL
+            target = url
+
+        name = endpoint(url, data)
+        t1 = time.time()
+        try:
+            while True:
+                conn, reused = self._connection(key, timeout)
+                try:
+                    if reused and data is not None and _closed_by_peer(conn):
+                        # don't send a POST into a connection we know is gone
+                        conn.close()
+                        continue
+                    if not reused:
+                        # failing to connect tells the request wasn't sent
+                        conn.connect()
+                    conn.request('POST' if data is not None else 'GET',
+                                 target, body=data, headers=request_headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                    break
+                except self._STALE:
+                    conn.close()
+                    # the server might have processed a POST already - only
+                    # GETs may be sent again
+                    if not reused or data is not None:
+                        raise
+                    log.debug('connection to %s got closed - reconnect', key[1])
+                except BaseException:
+                    conn.close()
+                    raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            if response.getheader('Content-Encoding') == 'gzip':
+                body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+            if not 200 <= response.status < 300:
+                raise HttpError(response.status, response.reason, url)
+        except Exception:
+            self._record(name, time.time() - t1, error=True)
+            raise
+        self._record(name, time.time() - t1)
+        return body
+
+    def stats(self):
+        ''' returns {endpoint: (count, errors, total_seconds, max_seconds)} '''
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        with self._lock:
+            self._close_idle()
+
+    def _connection(self, key, timeout):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                conn = idle.pop()
+                if conn.sock:
+                    conn.sock.settimeout(
+                        self._timeout if timeout is None else timeout)
+                return conn, True
+            proxy = self._proxies.get(key[0])
+        scheme, netloc = key
+        timeout = self._timeout if timeout is None else timeout
+        if proxy:
+            proxy_netloc = urllib.parse.urlsplit(proxy).netloc
+            conn = (http.client.HTTPSConnection if scheme == 'https' else
+                    http.client.HTTPConnection)(proxy_netloc, timeout=timeout)
+            if scheme == 'https':
+                conn.set_tunnel(netloc)
+        else:
+            conn = (http.client.HTTPSConnection if scheme == 'https' else
+                    http.client.HTTPConnection)(netloc, timeout=timeout)
+        return conn, False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self._max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _close_idle(self):
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.close()
+        self._idle = {}
+
+    def _record(self, name, duration, error=False):
+        with self._lock:
+            count, errors, total, maximum = self._stats.get(name, (0, 0, 0., 0.))
+            self._stats[name] = (count + 1, errors + error, total + duration,
+                                 max(maximum, duration))
+
+
+def _closed_by_peer(conn):
+    ''' whether an idle connection has been closed by the server (an idle
+        connection must not be readable) '''
+    if conn.sock is None:
+        return True
+    return bool(select.select([conn.sock], [], [], 0)[0])
+
+
+class TransportHandler(urllib.request.BaseHandler):
+    ''' lets urllib.request.urlopen() send its requests through an
+        HttpTransport, classified by request_class() unless the calling
+        thread has picked a class with priority() '''
+    # go before urllib's own handlers - proxies are the transport's job
+    handler_order = 50
+    _local = threading.local()
+
+    def __init__(self, transport):
+        self._transport = transport
+
+    def http_open(self, req):
+        url, data = req.full_url, req.data
+        priority = getattr(self._local, 'priority', None)
+        if priority is None:
+            priority = request_class(endpoint(url, data))
+        try:
+            body = self._transport.request(
+                url, data, headers=dict(req.header_items()),
+                timeout=(req.timeout if isinstance(req.timeout, (int, float))
+                         else None),
+                priority=priority)
+        except HttpError as exc:
+            raise urllib.error.HTTPError(
+                url, exc.status, exc.reason, email.message.Message(),
+                io.BytesIO(b''))
+        headers = email.message.Message()
+        headers['Content-Length'] = str(len(body))
+        response = urllib.response.addinfourl(
+            io.BytesIO(body), headers, url, 200)
+        response.msg = 'OK'
+        return response
+
+    https_open = http_open
+
+
+@contextlib.contextmanager
+def priority(value):
+    ''' makes the urllib requests of this thread use request class @value '''
+    local = TransportHandler._local
+    old = getattr(local, 'priority', None)
+    local.priority = value
+    try:
+        yield
+    finally:
+        local.priority = old
+
+
+_SHARED = None
+_SHARED_LOCK = threading.Lock()
+
+
+def shared() -> HttpTransport:
+    ''' the transport all API calls of this process should go through '''
+    global _SHARED
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            _SHARED = HttpTransport(limiter=RateLimiter(RATE, burst=int(RATE)),
+                                    cache=ResponseCache())
+        return _SHARED
+
+
+def install(transport=None):
+    ''' routes urllib.request.urlopen() - and thus all mftl API calls -
+        through @transport (default: shared()). Installing another opener
+        (e.g. mftl.util.set_proxies()) undoes this, so call it afterwards '''
+    urllib.request.install_opener(urllib.request.build_opener(
+        TransportHandler(transport or shared())))
+
+
+def configure_cache(allow_cached: bool):
+    ''' fresh answers always get cached in memory - with @allow_cached
+        (--allow-cached) they also go to disk and expired ones stand in
+        when the exchange can't be reached '''
+    shared().set_cache(ResponseCache(
+        directory=CACHE_DIRECTORY if allow_cached else None,
+        serve_stale=allow_cached))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import bisect
+
+from history_store import trade_key
+
+
+class Vema:
+    ''' volume weighted exponential moving average (like mftl.vema()) which
+        keeps its state so it can be continued with new values later '''
+    def __init__(self, alpha):
+        self._alpha = alpha
+        self._total = None
+        self._amount = None
+
+    def reset(self):
+        self._total = self._amount = None
+
+    def value(self):
+        return self._total / self._amount if self._amount else None
+
+    def update(self, totals, amounts):
+        ''' advances by @totals/@amounts and returns the new values '''
+        alpha, result = self._alpha, []
+        for total, amount in zip(totals, amounts):
+            if self._total is None:
+                self._total, self._amount = total, amount
+            else:
+                self._total = alpha * total + (1 - alpha) * self._total
+                self._amount = alpha * amount + (1 - alpha) * self._amount
+            result.append(self._total / self._amount)
+        return result
+
+
+class HistoryVema:
+    ''' Vema over the trades of a TradeHistory which on update() only
+        processes trades it has not seen yet '''
+    def __init__(self, trade_history, alpha):
+        self._trade_history = trade_history
+        self._vema = Vema(alpha)
+        self._times = []
+        self._rates = []
+        # number and key of the trades consumed so far - times alone can't
+        # tell apart trades of the same second
+        self._count = 0
+        self._last_key = None
+
+    def reset(self):
+        self._vema.reset()
+        self._times, self._rates = [], []
+        self._count, self._last_key = 0, None
+
+    def _consumed(self, data):
+        ''' returns the number of trades in @data we've already seen or None
+            if the history has changed behind what we've seen '''
+        if not self._count:
+            return 0
+        n = self._count
+        if len(data) >= n and trade_key(data[n - 1]) == self._last_key:
+            return n
+        # the history has dropped old trades - look for the last one we've
+        # seen among the trades of its second
+        last_time = self._times[-1]
+        i = bisect.bisect_right(data, last_time, key=lambda t: t['time'])
+        while i > 0 and data[i - 1]['time'] == last_time:
+            if trade_key(data[i - 1]) == self._last_key:
+                return i
+            i -= 1
+        return None
+
+    def update(self):
+        ''' returns times and vema rates like TradeHistory.get_plot_data() -
+            the lists are ours and valid until the next update() '''
+        data = self._trade_history.data()
+        if not data:
+            self.reset()
+            return self._times, self._rates
+        i = self._consumed(data)
+        if i is None or (self._times and data[0]['time'] < self._times[0]):
+            # older trades have been fetched - start over
+            self.reset()
+            i = 0
+        if i < len(data):
+            new = data[i:]
+            self._times.extend(t['time'] for t in new)
+            self._rates.extend(self._vema.update(
+                [t['total'] for t in new], [t['amount'] for t in new]))
+            self._last_key = trade_key(data[-1])
+        self._count = len(data)
+
+        # forget what the history has dropped
+        if self._times[0] < data[0]['time']:
+            k = bisect.bisect_left(self._times, data[0]['time'])
+            del self._times[:k], self._rates[:k]
+        return self._times, self._rates
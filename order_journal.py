@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import bisect
+import calendar
+import threading
+import logging as log
+
+
+def trade_time(entry):
+    ''' returns the UTC timestamp of a journal entry or an exchange trade
+        (which only comes with a 'date' string) '''
+    if 'time' in entry:
+        return float(entry['time'])
+    if 'date' in entry:
+        return float(calendar.timegm(
+            time.strptime(entry['date'], '%Y-%m-%d %H:%M:%S')))
+    return 0.
+
+
+class OrderJournal:
+    ''' append-only journal (one JSON object per line) of placed orders or
+        executed trades with an in-memory index by market and time.
+        Entries get fsync'ed, so nothing is lost once append() or extend()
+        has returned and a crash can at most leave a broken last line
+        (which gets skipped on load).
+        If @key is given entries with a known key are not added twice. '''
+    def __init__(self, filename, legacy_filename=None, key=None):
+        self._filename = filename
+        self._key = key
+        self._lock = threading.Lock()
+        self._times = {}
+        self._by_market = {}
+        self._keys = set()
+        self._load()
+        if (not self._by_market and legacy_filename and
+                os.path.exists(legacy_filename)):
+            self._import(legacy_filename)
+
+    def filename(self):
+        return self._filename
+
+    def _import(self, legacy_filename):
+        # the old format: one JSON list, rewritten for each order
+        log.info('import %r into %r', legacy_filename, self._filename)
+        self.extend(o for o in json.loads(open(legacy_filename).read()) if o)
+
+    def _load(self):
+        try:
+            f = open(self._filename, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            offset = 0
+            line = b''
+            for i, line in enumerate(f):
+                offset += len(line)
+                try:
+                    entry = json.loads(line.decode())
+                except ValueError:
+                    log.warning('skip broken line %d in %r', i + 1, self._filename)
+                    if not line.endswith(b'\n'):
+                        # an interrupted write - don't append to it
+                        os.truncate(self._filename, offset - len(line))
+                        line = b''
+                    continue
+                self._index(entry)
+        if line and not line.endswith(b'\n'):
+            # the write got interrupted right before the newline - add it,
+            # or the next entry would end up on the same line
+            with open(self._filename, 'ab') as f:
+                f.write(b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _index(self, entry):
+        if self._key:
+            self._keys.add(self._key(entry))
+        market = entry.get('market')
+        times = self._times.setdefault(market, [])
+        entries = self._by_market.setdefault(market, [])
+        t = trade_time(entry)
+        # entries mostly come in time order - so this is mostly an append
+        i = bisect.bisect_right(times, t)
+        times.insert(i, t)
+        entries.insert(i, entry)
+
+    def append(self, entry):
+        return self.extend([entry])
+
+    def extend(self, entries):
+        ''' appends all unknown @entries with a single fsync and returns
+            the entries which have been added '''
+        with self._lock:
+            new = []
+            for e in entries:
+                if self._key:
+                    k = self._key(e)
+                    if k in self._keys: continue
+                    self._keys.add(k)
+                new.append(e)
+            if not new: return new
+            with open(self._filename, 'a') as f:
+                f.write(''.join(json.dumps(e) + '\n' for e in new))
+                f.flush()
+                os.fsync(f.fileno())
+            for e in new:
+                self._index(e)
+        return new
+
+    def count(self):
+        with self._lock:
+            return sum(len(e) for e in self._by_market.values())
+
+    def markets(self):
+        with self._lock:
+            return set(self._by_market)
+
+    def entries(self, market=None, t_from=None, t_to=None):
+        ''' returns the entries (of @market if given) within
+            [@t_from, @t_to] ordered by time '''
+        with self._lock:
+            result = []
+            for m in ([market] if market is not None else self._by_market):
+                times = self._times.get(m, [])
+                i = 0 if t_from is None else bisect.bisect_left(times, t_from)
+                j = (len(times) if t_to is None else
+                     bisect.bisect_right(times, t_to))
+                result.extend(zip(times[i:j], self._by_market.get(m, [])[i:j]))
+        result.sort(key=lambda e: e[0])
+        return [entry for _, entry in result]
+
+    def by_market(self):
+        ''' returns {market: [entries newest first]} - the layout of
+            TraderData.trade_history() '''
+        with self._lock:
+            return {m: entries[::-1]
+                    for m, entries in self._by_market.items()}
+
+    def last(self, market, **match):
+        ''' returns the newest entry of @market with all fields given in
+            @match (e.g. type='buy') or None '''
+        with self._lock:
+            for entry in reversed(self._by_market.get(market, [])):
+                if all(entry.get(k) == v for k, v in match.items()):
+                    return entry
+        return None
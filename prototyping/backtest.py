@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+FEE = 0.9975
+BUY, SELL = 1, -1
+
+
+def crossover_events(ma_slow, ma_fast):
+    ''' returns indices and actions (BUY/SELL) of all crossings of
+        @ma_fast and @ma_slow, using the same conditions as
+        test_trade.simulate() '''
+    fast, slow = np.asarray(ma_fast), np.asarray(ma_slow)
+    buy = (fast[1:] >= slow[1:]) & (fast[:-1] < slow[:-1])
+    sell = (fast[1:] <= slow[1:]) & (fast[:-1] > slow[:-1])
+    indices = np.flatnonzero(buy | sell) + 1
+    return indices, np.where(buy[indices - 1], BUY, SELL)
+
+
+def executed_events(ma_slow, ma_fast):
+    ''' like crossover_events() but only the crossings which result in a
+        trade: we start with C1, so a sell before the first buy and every
+        repeated buy (sell) before the next sell (buy) get skipped '''
+    indices, actions = crossover_events(ma_slow, ma_fast)
+    keep = np.ones(len(actions), bool)
+    keep[1:] = actions[1:] != actions[:-1]
+    indices, actions = indices[keep], actions[keep]
+    if len(actions) and actions[0] == SELL:
+        indices, actions = indices[1:], actions[1:]
+    return indices, actions
+
+
+def _amounts(rates, indices, amount_C1, fee):
+    # amounts after each trade - this has to be done step by step to get
+    # exactly the same floating point results like simulate() (but there
+    # are only as many steps as trades)
+    result = []
+    amount = amount_C1
+    for k, r in enumerate(np.asarray(rates)[indices].tolist()):
+        amount = amount / r * fee if k % 2 == 0 else amount * r * fee
+        result.append(amount)
+    return result
+
+
+def crossover_backtest(rates, ma_slow, ma_fast, amount_C1=100., fee=FEE):
+    ''' vectorized test_trade.simulate(): returns (last_C1, last_C2, trades) '''
+    indices, _ = executed_events(ma_slow, ma_fast)
+    amounts = [amount_C1] + _amounts(rates, indices, amount_C1, fee)
+    trades = len(indices)
+    # amounts[k] is what we had before trade k, buys are even trades
+    last_buy = (trades - 1) // 2 * 2
+    last_sell = (trades - 2) // 2 * 2 + 1
+    return (amounts[last_buy] if trades >= 1 else 0,
+            amounts[last_sell] if trades >= 2 else 0,
+            trades)
+
+
+def equity_curve(rates, ma_slow, ma_fast, amount_C1=100., fee=FEE):
+    ''' value of the portfolio in C1 for each index '''
+    rates = np.asarray(rates, np.float64)
+    indices, _ = executed_events(ma_slow, ma_fast)
+    amounts = np.array([amount_C1] + _amounts(rates, indices, amount_C1, fee))
+    traded = np.searchsorted(indices, np.arange(len(rates)), side='right')
+    holding = amounts[traded]
+    return np.where(traded % 2 == 1, holding * rates, holding)
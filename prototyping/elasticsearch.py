@@ -8,6 +8,7 @@ import ujson as json
 import logging as log
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import trader
+from history_store import SegmentStore
 
 
 def get_args() -> dict:
@@ -28,7 +29,10 @@ def main():
         #th.save()
     # data = th.data() #[-1000:]
     # [print(d) for d in data]
-    bdata = th.rate_buckets(5 * 60)
+    store = SegmentStore(market, directory=os.path.join(
+        os.path.dirname(__file__), '..', 'cache'))
+    store.save(th.data())
+    bdata = store.columns().buckets(5 * 60).records()
     [print(d) for d in bdata]
     print('#%d/%.2fh => %d buckets' % (
         th.count(), th.get_duration() / 3600, len(bdata)))
@@ -9,6 +9,7 @@ import logging as log
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import mftl
 import mftl.qwtgraph
+from history_store import SegmentStore
 
 
 def foo():
@@ -24,16 +25,18 @@ def foo():
 
         # print(th.count(), th.get_duration()/3600)
 
-    data = th.data() #[-10000:]
+    # columns get built once and memory mapped afterwards
+    store = SegmentStore('BTC_ETH', directory=os.path.join(
+        os.path.dirname(__file__), '..', 'cache'))
+    store.save(th.data())
+    data = store.columns() #.slice(now - 10 * 3600)
 
-    #        [print(d) for d in data]
+    print(data.get_duration() / 3600)
 
-    print((data[-1]['time']-data[0]['time']) / 3600)
-
-    #totals = [e['total'] for e in data]
-    #amounts = [e['amount'] for e in data]
-    rates = [e['total'] / e['amount'] for e in data]
-    times = [e['time'] - now for e in data]
+    #totals = data.total
+    #amounts = data.amount
+    rates = data.total / data.amount
+    times = data.time - now
     #full = [(e['time'] - now, e['total'], e['amount'], e['total'] / e['amount']) for e in data]
 
     #[print('%.2f, %11.8f, %11.8f, %9.9f' % d) for d in full]
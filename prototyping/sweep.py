@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import heapq
+import argparse
+import functools
+import concurrent.futures
+from multiprocessing import shared_memory
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import mftl
+import test_trade
+from backtest import crossover_backtest
+
+# per worker process: market => (shared memory, [totals, amounts, rates])
+_markets = {}
+
+
+def grid(steps_fast=50, steps_slow=30, max_alpha=0.1):
+    ''' the (alpha_slow, alpha_fast) grid test_trade.try_market() used to
+        search, grouped by alpha_fast '''
+    for i in range(steps_fast):
+        ema_fast = max_alpha / steps_fast * i
+        yield ema_fast, [ema_fast / steps_slow * j for j in range(steps_slow)]
+
+
+def share(series):
+    ''' copies the (equally sized) arrays in @series into one shared memory
+        block which can be mapped by the worker processes '''
+    data = np.vstack(series).astype(np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    np.ndarray(data.shape, np.float64, buffer=shm.buf)[:] = data
+    return shm, data.shape
+
+
+def _init_worker(shared):
+    for m, (name, shape) in shared.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _markets[m] = (shm, np.ndarray(shape, np.float64, buffer=shm.buf))
+
+
+@functools.lru_cache(maxsize=256)
+def _ema(market, alpha):
+    totals, amounts, _ = _markets[market][1]
+    return np.asarray(mftl.vema(totals, amounts, alpha))
+
+
+def _run(market, alpha_fast, alphas_slow):
+    rates = _markets[market][1][2]
+    ma_fast = _ema(market, alpha_fast)
+    return [(market, alpha_slow, alpha_fast) + crossover_backtest(
+                rates, _ema(market, alpha_slow), ma_fast)
+            for alpha_slow in alphas_slow]
+
+
+def sweep(markets, parameters, workers=None, top=20):
+    ''' runs the crossover backtest for each market and each
+        (alpha_fast, [alpha_slow, ..]) in @parameters on a process pool
+        and returns the @top results ranked by resulting C1 amount '''
+    parameters = list(parameters)
+    shared, blocks = {}, []
+    for m in markets:
+        _, totals, amounts, rates = test_trade.load_market(m)
+        shm, shape = share((totals, amounts, rates))
+        blocks.append(shm)
+        shared[m] = (shm.name, shape)
+
+    best = []
+    t1 = time.time()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=_init_worker,
+                initargs=(shared,)) as pool:
+            futures = [pool.submit(_run, m, alpha_fast, alphas_slow)
+                       for m in markets for alpha_fast, alphas_slow in parameters]
+            for i, f in enumerate(concurrent.futures.as_completed(futures)):
+                for r in f.result():
+                    if len(best) < top:
+                        heapq.heappush(best, (r[3], r))
+                    else:
+                        heapq.heappushpop(best, (r[3], r))
+                print('[%d/%d] %.1fs best: %s' % (
+                    i + 1, len(futures), time.time() - t1,
+                    _format(max(best)[1]) if best else '-'))
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return [r for _, r in sorted(best, reverse=True)]
+
+
+def _format(result):
+    market, alpha_slow, alpha_fast, c1, c2, trades = result
+    return '%-10s %8.3f%% C1:%10.4f C2:%12.4f #%4d slow=%.6f fast=%.6f' % (
+        market, c1 - 100., c1, c2, trades, alpha_slow, alpha_fast)
+
+
+def print_table(results):
+    for i, r in enumerate(results):
+        print('%3d %s' % (i + 1, _format(r)))
+
+
+def get_args() -> dict:
+    parser = argparse.ArgumentParser(description='ema crossover sweep')
+    parser.add_argument("-v", "--verbose", action='store_true')
+    parser.add_argument("-a", "--all", action='store_true',
+                        help='use all cached trade_history-*.json markets')
+    parser.add_argument("-w", "--workers", type=int)
+    parser.add_argument("--steps-fast", type=int, default=50)
+    parser.add_argument("--steps-slow", type=int, default=30)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument('markets', nargs='*')
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    markets = (list(test_trade.cached_markets()) if args.all else
+               args.markets or ['BTC_ARDR'])
+    print_table(sweep(markets, grid(args.steps_fast, args.steps_slow),
+                      workers=args.workers, top=args.top))
+
+
+if __name__ == '__main__':
+    main()
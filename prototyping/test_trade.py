@@ -5,16 +5,13 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import mftl
 import mftl.px
 import mftl.qwtgraph
+from history_store import SegmentStore
+from backtest import FEE
 
 import time
 
-FEE = 0.9975
-
 
 def trade(times, totals, amounts, rates, alpha_ema_slow, alpha_ema_fast):
-    amount_C1 = 100.
-    amount_C2 = 0.
-
     ma_slow = mftl.vema(totals, amounts, alpha_ema_slow)
     ma_fast = mftl.vema(totals, amounts, alpha_ema_fast)
 
@@ -27,6 +24,14 @@ def trade(times, totals, amounts, rates, alpha_ema_slow, alpha_ema_fast):
     else:
         w = None
     #return
+    return simulate(times, rates, ma_slow, ma_fast, w, verbose=True)
+
+
+def simulate(times, rates, ma_slow, ma_fast, w=None, verbose=False):
+    # see backtest.crossover_backtest() for a (much faster) vectorized
+    # version when you're only interested in the result
+    amount_C1 = 100.
+    amount_C2 = 0.
     trades = 0
     last_C1 = 0
     last_C2 = 0
@@ -51,16 +56,17 @@ def trade(times, totals, amounts, rates, alpha_ema_slow, alpha_ema_fast):
             w.add_vmarker(times[i], 'red' if action == 'sell' else 'green')
             w.add_hmarker(d, 'red' if action == 'sell' else 'green')
         trades += 1
-        print('%.4d %.7d %9.2f %11.2f %11.9f %s' % (
-            i, times[i], amount_C1, amount_C2, d, action))
+        if verbose:
+            print('%.4d %.7d %9.2f %11.2f %11.9f %s' % (
+                i, times[i], amount_C1, amount_C2, d, action))
     return last_C1, last_C2, trades
 
-def try_market(m):
-    print(m)
+
+def load_market(m, min_duration=100 * 3600):
     th = mftl.TradeHistory(m)  # 0.0008 / 0.004
     th.load()
 
-    while th.get_duration() < 100 * 3600:
+    while th.get_duration() < min_duration:
         print('fetch..')
         try:
             th.fetch_next(api=mftl.px.PxApi, max_duration=-1)
@@ -70,29 +76,36 @@ def try_market(m):
         th.save()
 
     now = time.time()
-    cdata = [mftl.expand_bucket(b) for b in th.rate_buckets(5 * 60)] #[-500:]
-    times = [(e['time'] - now) / 3600 for e in cdata]
-    rates = [e['rate'] for e in cdata]
-    amounts = [e['amount_sell'] for e in cdata]
-    totals = [e['total_sell'] for e in cdata]
+    # columns get built once and memory mapped afterwards
+    store = SegmentStore(m, directory=os.path.join(
+        os.path.dirname(__file__), '..', 'cache'))
+    store.save(th.data())
+    cdata = store.columns().buckets(5 * 60) #[-500:]
+    times = (cdata.time - now) / 3600
+    rates = cdata.rate
+    amounts = cdata.amount_sell
+    totals = cdata.total_sell
 
     print('#: %d / %.2fh buckets: %d'% (
         th.count(), th.get_duration() / 3600, len(times)))
+    return times, totals, amounts, rates
+
+
+def cached_markets(directory='..'):
+    for f in sorted(os.listdir(directory)):
+        if not (f.startswith('trade_history') and f.endswith('.json')):
+            continue
+        yield f.split('.')[0].split('-')[1]
 
-    if False:
 
-        bmax = 0
-        stepsi = 50
-        stepsj = 30
-        for i in range(stepsi):
-            for j in range(stepsj):
-                ema_fast = 0.1 / stepsi * i
-                ema_slow = ema_fast / stepsj * j
-                b, x, t = trade(times, totals, amounts, rates, ema_slow, ema_fast)
-                if bmax < b:
-                    bmax = b
-                    best = (i, j, b - 100., b, x, t, ema_slow, ema_fast, ema_fast > ema_slow)
-        print('i%d/j%d, %.3f%% C1:%.4f C2:%.4f #%d slow=%.6f fast=%.6f %r' % best)
+def try_market(m):
+    print(m)
+    times, totals, amounts, rates = load_market(m)
+
+    if False:
+        import sweep
+        sweep.print_table(sweep.sweep(
+            [m], sweep.grid(steps_fast=50, steps_slow=30)))
     else:
 #        print(trade(times, totals, amounts, rates, 0.008000, 0.036000))
         #        print(trade(times, totals, amounts, rates, 0.001000, 0.036000))
@@ -102,10 +115,7 @@ def try_market(m):
 def main():
     with mftl.qwtgraph.qtapp() as app:
         if False:
-            for f in os.listdir('..'):
-                if not (f.startswith('trade_history') and f.endswith('.json')):
-                    continue
-                m = f.split('.')[0].split('-')[1]
+            for m in cached_markets():
                 try_market(m)
         else:
             try_market('BTC_ARDR')
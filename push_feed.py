@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+''' live trades and order book updates from the exchange's WebSocket push
+    API - fake_exchange.py replays recorded feeds for offline use '''
+
+import os
+import ssl
+import json
+import time
+import base64
+import random
+import socket
+import hashlib
+import threading
+import urllib.parse
+import logging as log
+
+URL = 'wss://api2.poloniex.com'
+HEARTBEAT = 1010
+_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+TEXT, CLOSE, PING, PONG = 0x1, 0x8, 0x9, 0xA
+
+
+class WebSocketClosed(ConnectionError):
+    pass
+
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1(key.encode() + _GUID).digest()).decode()
+
+
+def _apply_mask(data, key):
+    n = len(data)
+    key = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')
+            ).to_bytes(n, 'big')
+
+
+class WebSocket:
+    ''' just enough of RFC 6455 for the push API: text frames, ping/pong
+        and close. Clients mask what they send, servers don't. '''
+    def __init__(self, sock, rfile, mask):
+        self._sock = sock
+        self._rfile = rfile
+        self._mask = mask
+        self._send_lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, url, timeout=10., connect_timeout=None):
+        ''' @connect_timeout applies to connecting and the handshake,
+            @timeout to receiving afterwards '''
+        parsed = urllib.parse.urlsplit(url)
+        secure = parsed.scheme == 'wss'
+        port = parsed.port or (443 if secure else 80)
+        sock = socket.create_connection(
+            (parsed.hostname, port),
+            timeout if connect_timeout is None else connect_timeout)
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(
+                sock, server_hostname=parsed.hostname)
+        key = base64.b64encode(os.urandom(16)).decode()
+        sock.sendall((
+            'GET %s HTTP/1.1\r\nHost: %s\r\nUpgrade: websocket\r\n'
+            'Connection: Upgrade\r\nSec-WebSocket-Key: %s\r\n'
+            'Sec-WebSocket-Version: 13\r\n\r\n' % (
+                parsed.path or '/', parsed.netloc, key)).encode())
+        rfile = sock.makefile('rb')
+        status = rfile.readline().decode()
+        headers = {}
+        for line in iter(rfile.readline, b'\r\n'):
+            if not line:
+                raise WebSocketClosed('connection closed during handshake')
+            name, _, value = line.decode().partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if (status.split()[1:2] != ['101'] or
+                headers.get('sec-websocket-accept') != accept_key(key)):
+            sock.close()
+            raise ConnectionError('no WebSocket upgrade: %r' % status.strip())
+        sock.settimeout(timeout)
+        return cls(sock, rfile, mask=True)
+
+    @classmethod
+    def accept(cls, handler):
+        ''' answers the upgrade request of a BaseHTTPRequestHandler '''
+        handler.send_response(101)
+        handler.send_header('Upgrade', 'websocket')
+        handler.send_header('Connection', 'Upgrade')
+        handler.send_header('Sec-WebSocket-Accept',
+                            accept_key(handler.headers['Sec-WebSocket-Key']))
+        handler.end_headers()
+        handler.close_connection = True
+        return cls(handler.connection, handler.rfile, mask=False)
+
+    def send(self, payload, opcode=TEXT):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        n = len(payload)
+        mask_bit = 0x80 if self._mask else 0
+        header = bytes([0x80 | opcode])
+        if n < 126:
+            header += bytes([mask_bit | n])
+        elif n < 1 << 16:
+            header += bytes([mask_bit | 126]) + n.to_bytes(2, 'big')
+        else:
+            header += bytes([mask_bit | 127]) + n.to_bytes(8, 'big')
+        if self._mask:
+            key = os.urandom(4)
+            header += key
+            payload = _apply_mask(payload, key)
+        with self._send_lock:
+            self._sock.sendall(header + payload)
+
+    def recv(self) -> str:
+        ''' returns the next text message - answers pings on the way '''
+        message = b''
+        while True:
+            opcode, final, payload = self._recv_frame()
+            if opcode == PING:
+                self.send(payload, PONG)
+            elif opcode == CLOSE:
+                try:
+                    self.send(payload[:2], CLOSE)
+                except OSError:
+                    pass
+                raise WebSocketClosed('closed by peer')
+            elif opcode != PONG:
+                message += payload
+                if final:
+                    return message.decode()
+
+    def _read(self, n):
+        data = self._rfile.read(n)
+        if len(data) < n:
+            raise WebSocketClosed('connection lost')
+        return data
+
+    def _recv_frame(self):
+        b0, b1 = self._read(2)
+        n = b1 & 0x7f
+        if n == 126:
+            n = int.from_bytes(self._read(2), 'big')
+        elif n == 127:
+            n = int.from_bytes(self._read(8), 'big')
+        key = self._read(4) if b1 & 0x80 else None
+        payload = self._read(n)
+        if key:
+            payload = _apply_mask(payload, key)
+        return b0 & 0x0f, bool(b0 & 0x80), payload
+
+    def close(self):
+        try:
+            self.send(b'\x03\xe8', CLOSE)
+        except OSError:
+            pass
+        try:
+            # wakes up a recv() blocked in another thread, close() doesn't
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+def parse_trade(update):
+    ''' ['t', id, side, rate, amount, timestamp] => trade dict as held by
+        TradeHistory.data() '''
+    _, trade_id, side, rate, amount, timestamp = update[:6]
+    rate, amount = float(rate), float(amount)
+    return {'tradeID': int(trade_id), 'time': float(timestamp), 'rate': rate,
+            'amount': amount, 'total': rate * amount,
+            'type': 'buy' if side == 1 else 'sell'}
+
+
+class PushFeed:
+    ''' keeps a connection to the push API, subscribes to markets and hands
+        their new trades to @on_trades(market, trades) while keeping their
+        order books up to date. Reconnects with jittered backoff and tells
+        about it via @on_state(connected) so callers can poll meanwhile.
+        Callbacks run on the feed's thread. With @record all messages get
+        written to that file (see fake_exchange.py). stop() may have to
+        wait for a pending connect, so keep @connect_timeout short. '''
+    def __init__(self, url=URL, on_trades=None, on_state=None, record=None,
+                 timeout=30., connect_timeout=5.):
+        self._url = url
+        self._on_trades = on_trades
+        self._on_state = on_state
+        self._record = record
+        self._timeout = timeout
+        self._connect_timeout = connect_timeout
+        self._lock = threading.Lock()
+        self._markets = set()
+        self._channels = {}
+        self._sequences = {}
+        self._books = {}
+        self._ws = None
+        self._session = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='push-feed', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            ws = self._ws
+        if ws:
+            ws.close()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def connected(self):
+        with self._lock:
+            return self._ws is not None
+
+    def session(self):
+        ''' number of the current connection (None while disconnected) -
+            trades of a new session may follow a gap '''
+        with self._lock:
+            return self._session if self._ws else None
+
+    def markets(self):
+        with self._lock:
+            return set(self._markets)
+
+    def subscribe(self, market):
+        with self._lock:
+            if market in self._markets: return
+            self._markets.add(market)
+            ws = self._ws
+        if ws:
+            self._send_subscribe(ws, market)
+
+    def order_book(self, market):
+        ''' returns ({rate: amount} of asks, {rate: amount} of bids) '''
+        with self._lock:
+            asks, bids = self._books.get(market, ({}, {}))
+            return dict(asks), dict(bids)
+
+    def _send_subscribe(self, ws, market):
+        ws.send(json.dumps({'command': 'subscribe', 'channel': market}))
+
+    def _run(self):
+        attempt = 0
+        while not self._stop.is_set():
+            try:
+                ws = WebSocket.connect(
+                    self._url, self._timeout, self._connect_timeout)
+            except OSError as exc:
+                log.warning('could not connect to push feed: %r', exc)
+            else:
+                self._serve(ws)
+                attempt = 0
+            # full jitter, so clients don't come back all at once
+            self._stop.wait(random.uniform(0., min(60., 2. ** attempt)))
+            attempt += 1
+
+    def _serve(self, ws):
+        log.info('connected to push feed %s', self._url)
+        with self._lock:
+            self._ws = ws
+            self._session += 1
+            markets = set(self._markets)
+            self._channels, self._sequences, self._books = {}, {}, {}
+        record = open(self._record, 'a') if self._record else None
+        t_last = time.time()
+        try:
+            for m in markets:
+                self._send_subscribe(ws, m)
+            if self._on_state:
+                self._on_state(True)
+            while not self._stop.is_set():
+                message = ws.recv()
+                if record:
+                    now = time.time()
+                    record.write(json.dumps([now - t_last, message]) + '\n')
+                    t_last = now
+                self._handle(json.loads(message))
+        except (OSError, ValueError) as exc:
+            if not self._stop.is_set():
+                log.warning('push feed disconnected: %r', exc)
+        except (TypeError, KeyError, IndexError) as exc:
+            # a message we don't understand - better start over than stop
+            log.error('push feed protocol error: %r', exc)
+        finally:
+            with self._lock:
+                self._ws = None
+            ws.close()
+            if record:
+                record.close()
+            if self._on_state:
+                self._on_state(False)
+
+    def _handle(self, message):
+        channel = message[0]
+        if channel == HEARTBEAT or len(message) < 3:
+            return
+        sequence = message[1]
+        last = self._sequences.get(channel)
+        if last is not None and sequence != last + 1:
+            # we've missed updates - start over rather than keep a wrong book
+            raise ValueError('missed updates on channel %r' % channel)
+        self._sequences[channel] = sequence
+        trades = []
+        with self._lock:
+            for update in message[2]:
+                if update[0] == 'i':
+                    market = update[1]['currencyPair']
+                    self._channels[channel] = market
+                    asks, bids = update[1]['orderBook']
+                    self._books[market] = (
+                        {float(r): float(a) for r, a in asks.items()},
+                        {float(r): float(a) for r, a in bids.items()})
+                    continue
+                market = self._channels.get(channel)
+                if market is None: continue
+                if update[0] == 'o':
+                    book = self._books[market][1 if update[1] == 1 else 0]
+                    rate, amount = float(update[2]), float(update[3])
+                    if amount:
+                        book[rate] = amount
+                    else:
+                        book.pop(rate, None)
+                elif update[0] == 't':
+                    trades.append(parse_trade(update))
+            market = self._channels.get(channel)
+        if trades and self._on_trades:
+            self._on_trades(market, sorted(trades, key=lambda t: t['time']))
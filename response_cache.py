@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import hashlib
+import threading
+import collections
+import logging as log
+
+# seconds an answer stays fresh - endpoints not listed don't get cached
+TTLS = {
+    'public/returnTicker': 5,
+    'public/return24hVolume': 60,
+    'public/returnOrderBook': 2,
+    'public/returnChartData': 300,
+    'public/returnCurrencies': 3 * 24 * 3600,
+}
+
+
+class ResponseCache:
+    ''' caches answers of public endpoints for their TTL in an LRU of at
+        most @max_entries answers and (if @directory is given) in at most
+        @max_files files on disk, so they survive a restart. With
+        @serve_stale expired answers can stand in when the exchange can't
+        be reached (--allow-cached). '''
+    def __init__(self, ttls=None, max_entries=256, directory=None,
+                 serve_stale=False, max_files=1024):
+        self._ttls = dict(TTLS if ttls is None else ttls)
+        self._max_entries = max_entries
+        self._max_files = max_files
+        self._directory = directory
+        self._serve_stale = serve_stale
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._hits = self._misses = 0
+        self._files = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._files = len(self._list_files())
+
+    def ttl(self, name):
+        return self._ttls.get(name)
+
+    def serve_stale(self):
+        return self._serve_stale
+
+    def get(self, name, url, max_age=None):
+        ''' returns the answer to @url if it's younger than @max_age
+            (default: the TTL of endpoint @name) or None '''
+        max_age = self._ttls.get(name) if max_age is None else max_age
+        if not max_age:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry:
+                self._entries.move_to_end(url)
+        if entry is None and self._directory:
+            entry = self._load(url)
+        if entry is None or now - entry[0] > max_age:
+            with self._lock:
+                self._misses += 1
+            return None
+        with self._lock:
+            self._hits += 1
+            self._put(url, entry)
+        return entry[1]
+
+    def put(self, name, url, body):
+        # stale answers only stand in for endpoints we cache anyway
+        if not self._ttls.get(name):
+            return
+        entry = (time.time(), body)
+        with self._lock:
+            self._put(url, entry)
+        if self._directory:
+            self._store(url, entry)
+
+    def stats(self):
+        ''' returns (hits, misses, entries in memory) '''
+        with self._lock:
+            return self._hits, self._misses, len(self._entries)
+
+    def _put(self, url, entry):
+        self._entries[url] = entry
+        self._entries.move_to_end(url)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _filename(self, url):
+        return os.path.join(
+            self._directory, hashlib.sha1(url.encode()).hexdigest())
+
+    def _load(self, url):
+        filename = self._filename(url)
+        try:
+            with open(filename, 'rb') as f:
+                return os.fstat(f.fileno()).st_mtime, f.read()
+        except FileNotFoundError:
+            return None
+
+    def _store(self, url, entry):
+        filename = self._filename(url)
+        tmp = '%s.%d.tmp' % (filename, threading.get_ident())
+        try:
+            new = not os.path.exists(filename)
+            with open(tmp, 'wb') as f:
+                f.write(entry[1])
+            os.utime(tmp, (entry[0], entry[0]))
+            os.replace(tmp, filename)
+        except OSError as exc:
+            log.warning('could not cache %r: %r', url, exc)
+            return
+        with self._lock:
+            self._files += new
+            evict = self._files > self._max_files
+        if evict:
+            self._evict()
+
+    def _list_files(self):
+        return [os.path.join(self._directory, f)
+                for f in os.listdir(self._directory) if not f.endswith('.tmp')]
+
+    def _evict(self):
+        ''' removes the oldest answers from disk - a tenth more than needed,
+            so we don't have to list the directory on every put() '''
+        files = []
+        for f in self._list_files():
+            try:
+                files.append((os.path.getmtime(f), f))
+            except FileNotFoundError:
+                pass
+        files.sort()
+        keep = self._max_files * 9 // 10
+        for _, f in files[:max(0, len(files) - keep)]:
+            try:
+                os.remove(f)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._files = min(len(files), keep)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import time
+import bisect
+import queue
+import itertools
+import threading
+import traceback
+import logging as log
+
+from utils import backoff
+
+
+class Task:
+    def __init__(self, fn, priority, lane, retry: bool, key=None, seq=0):
+        self.fn = fn
+        self.priority = priority
+        self.lane = lane
+        self.retry = retry
+        self.key = key
+        self.seq = seq
+        self.cancelled = False
+        self.t_put = time.time()
+
+    def __lt__(self, other):
+        # same priority: first come, first serve
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TaskScheduler:
+    ''' runs tasks on separate lanes - each with its own priority queue and
+        worker threads - so e.g. a slow market update can never delay an
+        order. Tasks with a key are coalesced while pending and never run
+        concurrently (see put()). '''
+    def __init__(self, lanes: dict):
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._pending = {}
+        self._running = {}
+        self._rerun = {}
+        self._stats = {}
+        self._queues = {lane: queue.PriorityQueue() for lane in lanes}
+        self._threads = [
+            threading.Thread(target=self._worker_thread_fn, args=(lane,),
+                             name='%s-%d' % (lane, i))
+            for lane, count in lanes.items() for i in range(count)]
+        for t in self._threads:
+            t.start()
+
+    def put(self, fn, priority, lane, retry=True, key=None):
+        ''' enqueues @fn - if a task with the same @key is still pending
+            both get merged into one (with the higher priority). If it's
+            running @fn gets enqueued once it has finished, so a key never
+            runs twice at a time - not even on different lanes. '''
+        with self._lock:
+            running = key is not None and key in self._running
+            waiting = self._rerun if running else self._pending
+            pending = waiting.get(key) if key is not None else None
+            if pending and pending.priority <= priority:
+                log.debug('task %r is already pending', key)
+                return pending
+            task = Task(fn, priority, lane, retry, key, next(self._seq))
+            if pending:
+                # can't re-sort a queue - replace the pending task instead
+                log.debug('raise priority of pending task %r', key)
+                pending.cancel()
+            if key is not None:
+                waiting[key] = task
+            if running:
+                log.debug('task %r is running - run again afterwards', key)
+                return task
+        self._queues[lane].put(task)
+        return task
+
+    def cancel(self, key):
+        with self._lock:
+            task = self._pending.pop(key, None) or self._rerun.pop(key, None)
+            if task:
+                task.cancel()
+        return task is not None
+
+    def qsize(self, lane=None):
+        return sum(q.qsize() for l, q in self._queues.items()
+                   if lane is None or l == lane)
+
+    def is_alive(self):
+        return all(t.is_alive() for t in self._threads)
+
+    def stats(self):
+        ''' returns {key: (count, total_seconds, max_seconds)} '''
+        with self._lock:
+            return dict(self._stats)
+
+    def shutdown(self):
+        ''' drops all pending tasks and waits for running ones to finish '''
+        for lane, q in self._queues.items():
+            for t in self._threads:
+                if t.name.startswith(lane + '-'):
+                    q.put(Task(None, -1, lane, False, seq=-1))
+        for t in self._threads:
+            t.join()
+
+    def _worker_thread_fn(self, lane):
+        while True:
+            task = self._queues[lane].get()
+            if task.fn is None:
+                log.info('exit worker thread %r', threading.current_thread().name)
+                return
+            with self._lock:
+                if task.cancelled:
+                    log.debug('skip cancelled task %r', task.key or task.fn)
+                    continue
+                if task.key is not None:
+                    # keep the key reserved until the task has finished
+                    del self._pending[task.key]
+                    self._running[task.key] = task
+            log.debug('got new task..')
+            t1 = time.time()
+            try:
+                # back off so a struggling exchange gets some air
+                backoff(task.fn, tries=3 if task.retry else 1,
+                        name=str(task.key or task.fn))
+            except Exception as exc:
+                traceback.print_exc()
+                log.error('giving up trying to call %r: %r', task.fn, exc)
+            self._record(task, t1, time.time())
+            if task.key is not None:
+                self._finish(task.key)
+
+    def _finish(self, key):
+        with self._lock:
+            del self._running[key]
+            task = self._rerun.pop(key, None)
+            if task is None:
+                return
+            self._pending[key] = task
+        self._queues[task.lane].put(task)
+
+    def _record(self, task, t_start, t_end):
+        duration = t_end - t_start
+        log.debug('task %r took %.3fs (waited %.3fs)',
+                  task.key or task.fn, duration, t_start - task.t_put)
+        key = task.key or getattr(task.fn, '__qualname__', repr(task.fn))
+        with self._lock:
+            count, total, maximum = self._stats.get(key, (0, 0., 0.))
+            self._stats[key] = (count + 1, total + duration,
+                                max(maximum, duration))
+
+
+class AdaptiveRefresh:
+    ''' picks a poll interval for each market from its trade arrival rate:
+        markets are polled about every @target_trades new trades (within
+        [@min_interval, @max_interval]), while all markets together stay
+        below @budget polls per second. Markets with a higher weight get
+        polled more often. '''
+    def __init__(self, budget, min_interval=20, max_interval=1800,
+                 target_trades=20, window=3600):
+        self._budget = budget
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._target_trades = target_trades
+        self._window = window
+        self._lock = threading.Lock()
+        self._rates = {}
+        self._weights = {}
+        self._next = {}
+        self._intervals = {}
+
+    def add(self, market, weight=1.):
+        with self._lock:
+            self._rates.setdefault(market, None)
+            self._weights[market] = weight
+            self._next.setdefault(market, 0.)
+            self._update_intervals()
+
+    def set_weight(self, market, weight):
+        with self._lock:
+            if self._weights.get(market) == weight: return
+            self._weights[market] = weight
+            self._update_intervals()
+
+    def observe(self, market, trade_history, now=None):
+        ''' learns the trade rate from the trades of the last @window seconds
+            (up to now - a market which stopped trading has a rate of 0) '''
+        data = trade_history.data()
+        now = time.time() if now is None else now
+        if not data:
+            # nothing traded as far back as we've fetched
+            rate = 0.
+        else:
+            i = bisect.bisect_right(data, now - self._window,
+                                    key=lambda t: t['time'])
+            duration = min(self._window, now - data[0]['time'])
+            rate = (len(data) - i) / duration if duration > 0 else None
+        with self._lock:
+            self._rates[market] = rate
+            self._update_intervals()
+
+    def intervals(self):
+        with self._lock:
+            return dict(self._intervals)
+
+    def due(self, now=None):
+        ''' returns markets which should be polled now (and assumes they
+            will be) '''
+        now = time.time() if now is None else now
+        with self._lock:
+            result = [m for m, t in self._next.items() if t <= now]
+            for m in result:
+                self._next[m] = now + self._intervals[m]
+        return result
+
+    def _update_intervals(self):
+        ideal = {}
+        for m, rate in self._rates.items():
+            # no or unknown activity: don't waste the budget on it
+            ideal[m] = (self._max_interval if not rate else
+                        self._target_trades / (rate * self._weights[m]))
+        clamp = lambda v: min(self._max_interval, max(self._min_interval, v))
+        intervals = {m: clamp(v) for m, v in ideal.items()}
+        # stretch all intervals until we're within the budget
+        for _ in range(10):
+            load = sum(1. / v for v in intervals.values())
+            if load <= self._budget: break
+            intervals = {m: clamp(v * load / self._budget)
+                         for m, v in intervals.items()}
+        for m, v in intervals.items():
+            if m in self._intervals and m in self._next:
+                # apply a new interval right away
+                self._next[m] += v - self._intervals[m]
+        self._intervals = intervals
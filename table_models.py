@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+from PyQt4 import QtCore
+
+
+class RowTableModel(QtCore.QAbstractTableModel):
+    ''' table model holding rows identified by a key. set_rows() compares
+        the new rows with the current ones and only signals rows which
+        have been added, removed or changed '''
+    def __init__(self, columns, parent=None):
+        ''' @columns: list of (header, format) tuples '''
+        super().__init__(parent)
+        self._headers = [h for h, _ in columns]
+        self._formats = [f for _, f in columns]
+        self._keys = []
+        self._rows = {}
+        self._sort_order = None
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._keys)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._headers)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return self._headers[section]
+        return str(section + 1)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        value = self._rows[self._keys[index.row()]][index.column()]
+        return self._formats[index.column()] % value
+
+    def key(self, row):
+        return self._keys[row]
+
+    def row(self, key):
+        return self._rows.get(key)
+
+    def set_rows(self, rows: dict):
+        ''' @rows: {key: (value column 0, value column 1, ..)} '''
+        removed = [i for i, k in enumerate(self._keys) if k not in rows]
+        for i in reversed(removed):
+            self.beginRemoveRows(QtCore.QModelIndex(), i, i)
+            del self._rows[self._keys[i]]
+            del self._keys[i]
+            self.endRemoveRows()
+
+        changed = False
+        for i, k in enumerate(self._keys):
+            if self._rows[k] == rows[k]: continue
+            self._rows[k] = rows[k]
+            self.dataChanged.emit(
+                self.index(i, 0), self.index(i, len(self._headers) - 1))
+            changed = True
+
+        added = [k for k in rows if k not in self._rows]
+        if added:
+            self.beginInsertRows(
+                QtCore.QModelIndex(), len(self._keys),
+                len(self._keys) + len(added) - 1)
+            for k in added:
+                self._keys.append(k)
+                self._rows[k] = rows[k]
+            self.endInsertRows()
+
+        if (changed or added) and self._sort_order:
+            self.sort(*self._sort_order)
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self._sort_order = (column, order)
+        keys = sorted(self._keys, key=lambda k: self._rows[k][column],
+                      reverse=(order == QtCore.Qt.DescendingOrder))
+        if keys == self._keys: return
+        self.layoutAboutToBeChanged.emit()
+        old_keys, self._keys = self._keys, keys
+        new_rows = {k: i for i, k in enumerate(keys)}
+        persistent = self.persistentIndexList()
+        self.changePersistentIndexList(persistent, [
+            self.index(new_rows[old_keys[i.row()]], i.column())
+            for i in persistent])
+        self.layoutChanged.emit()
+
+
+class LogListModel(QtCore.QAbstractListModel):
+    ''' list model keeping the last @max_rows lines only '''
+    def __init__(self, max_rows, parent=None):
+        super().__init__(parent)
+        self._max_rows = max_rows
+        self._lines = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._lines)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        return self._lines[index.row()]
+
+    def append(self, lines):
+        lines = lines[-self._max_rows:]
+        overflow = len(self._lines) + len(lines) - self._max_rows
+        if overflow > 0:
+            self.beginRemoveRows(QtCore.QModelIndex(), 0, overflow - 1)
+            del self._lines[:overflow]
+            self.endRemoveRows()
+        self.beginInsertRows(
+            QtCore.QModelIndex(), len(self._lines),
+            len(self._lines) + len(lines) - 1)
+        self._lines.extend(lines)
+        self.endInsertRows()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import time
+import gzip
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+import http.client
+
+import fake_exchange
+from http_transport import HttpTransport, HttpError
+
+
+class DroppingServer:
+    ''' answers GETs (keeping the connection alive) but closes the
+        connection after reading a POST - as if the exchange had processed
+        an order and then crashed '''
+    def __init__(self):
+        self.posts = 0
+        self._sock = socket.socket()
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen()
+        self.url = 'http://127.0.0.1:%d' % self._sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._sock.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(
+                target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn, conn.makefile('rb') as rfile:
+            while True:
+                request = rfile.readline()
+                if not request:
+                    return
+                length = 0
+                for line in iter(rfile.readline, b'\r\n'):
+                    name, _, value = line.decode().partition(':')
+                    if name.lower() == 'content-length':
+                        length = int(value)
+                rfile.read(length)
+                if request.startswith(b'POST'):
+                    self.posts += 1
+                    return
+                conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}')
+
+
+class TestPost(unittest.TestCase):
+    def setUp(self):
+        self.server = DroppingServer()
+        self.transport = HttpTransport(timeout=2., tries=4)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.close()
+
+    def test_post_dropped_after_processing_is_not_resent(self):
+        # keep a connection alive first, so the POST can go on a reused one
+        self.assertEqual(
+            self.transport.request(self.server.url + '/public?command=x'), b'{}')
+        with self.assertRaises(OSError):
+            self.transport.request(self.server.url + '/tradingApi',
+                                   data='command=buy&amount=1')
+        self.assertEqual(self.server.posts, 1)
+
+    def test_post_on_new_connection_is_not_resent(self):
+        with self.assertRaises(OSError):
+            self.transport.request(self.server.url + '/tradingApi',
+                                   data='command=buy&amount=1')
+        self.assertEqual(self.server.posts, 1)
+
+
+class TestSignedPost(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = fake_exchange.start_server(
+            0, self.directory, error_rate=1.)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_post_is_not_retried_on_503(self):
+        transport = HttpTransport(tries=4)
+        with self.assertRaises(HttpError) as cm:
+            transport.request(self.url + '/tradingApi',
+                              data='command=buy&nonce=1')
+        self.assertEqual(cm.exception.status, 503)
+        self.assertEqual(transport.stats()['tradingApi/buy'][:2], (1, 1))
+
+
+class TestFakeExchange(unittest.TestCase):
+    TICKER = b'{"BTC_ETH": {"last": "0.1"}}'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(fake_exchange.recording_path(
+                self.directory, 'public/returnTicker'), 'wb') as f:
+            f.write(self.TICKER)
+        self.server = None
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def start(self, **kwargs):
+        self.server = fake_exchange.start_server(0, self.directory, **kwargs)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.ticker = self.url + '/public?command=returnTicker'
+
+    def test_connection_reuse(self):
+        self.start(connect_latency=.1)
+        transport = HttpTransport()
+        t1 = time.time()
+        for _ in range(5):
+            self.assertEqual(transport.request(self.ticker), self.TICKER)
+        # one connect latency, not five
+        self.assertLess(time.time() - t1, .3)
+
+    def test_get_retried_on_503(self):
+        # with seed 1 the first request fails, the second one doesn't
+        self.start(error_rate=.5, seed=1)
+        transport = HttpTransport(tries=4)
+        self.assertEqual(transport.request(self.ticker), self.TICKER)
+        self.assertEqual(transport.stats()['public/returnTicker'][:2], (2, 1))
+
+    def test_404_is_passed_through(self):
+        self.start()
+        transport = HttpTransport(tries=4)
+        with self.assertRaises(HttpError) as cm:
+            transport.request(self.url + '/public?command=returnNothing')
+        self.assertEqual(cm.exception.status, 404)
+        self.assertEqual(transport.stats()['public/returnNothing'][:2], (1, 1))
+
+    def test_gzip(self):
+        self.start()
+        # the fake exchange compresses when asked to, as the transport does
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        conn.request('GET', '/public?command=returnTicker',
+                     headers={'Accept-Encoding': 'gzip'})
+        response = conn.getresponse()
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(gzip.decompress(response.read()), self.TICKER)
+        conn.close()
+        self.assertEqual(HttpTransport().request(self.ticker), self.TICKER)
+
+
+if __name__ == '__main__':
+    unittest.main()
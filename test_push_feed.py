@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+import fake_exchange
+from push_feed import PushFeed, HEARTBEAT
+
+INIT = [148, 1, [['i', {'currencyPair': 'BTC_ETH',
+                        'orderBook': [{'0.1': '1'}, {'0.09': '2'}]}]]]
+UPDATE = [148, 2, [['o', 0, '0.1', '0'], ['o', 1, '0.095', '3'],
+                   ['t', '42', 1, '0.1', '2', 1500000000]]]
+# keeps the connection open for a while after the interesting part
+IDLE = [5., [HEARTBEAT]]
+
+
+def wait_for(condition, timeout=5.):
+    t_end = time.time() + timeout
+    while not condition():
+        if time.time() > t_end:
+            return False
+        time.sleep(.01)
+    return True
+
+
+class TestPushFeed(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = None
+        self.feed = None
+        self.trades = []
+        self.states = []
+
+    def tearDown(self):
+        if self.feed:
+            self.feed.stop()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def start(self, *lines):
+        ''' replays @lines ([delay, message]) to each connection '''
+        with open(os.path.join(self.directory, 'feed.jsonl'), 'w') as f:
+            for delay, message in lines:
+                f.write(json.dumps([delay, json.dumps(message)]) + '\n')
+        self.server = fake_exchange.start_server(0, self.directory)
+        self.feed = PushFeed(
+            'ws://127.0.0.1:%d/' % self.server.server_address[1],
+            on_trades=lambda m, trades: self.trades.append((m, trades)),
+            on_state=self.states.append, connect_timeout=1.)
+        self.feed.subscribe('BTC_ETH')
+        self.feed.start()
+
+    def test_trades_and_order_book(self):
+        self.start([0., INIT], [0., UPDATE], IDLE)
+        self.assertTrue(wait_for(lambda: self.trades))
+        self.assertEqual(self.trades[0], ('BTC_ETH', [{
+            'tradeID': 42, 'time': 1500000000., 'rate': .1, 'amount': 2.,
+            'total': .2, 'type': 'buy'}]))
+        self.assertEqual(self.feed.order_book('BTC_ETH'),
+                         ({}, {.09: 2., .095: 3.}))
+        self.assertEqual(self.states, [True])
+        self.assertTrue(self.feed.connected())
+
+    def test_reconnect_at_end_of_feed(self):
+        self.start([0., INIT], [0., UPDATE])
+        self.assertTrue(wait_for(lambda: self.states[:3] == [True, False, True]))
+        self.assertTrue(wait_for(lambda: len(self.trades) >= 2))
+
+    def test_sequence_gap(self):
+        gap = [148, 3, UPDATE[2]]
+        self.start([0., INIT], [0., gap], IDLE)
+        self.assertTrue(wait_for(lambda: self.states[:2] == [True, False],
+                                 timeout=2.))
+        # the update after the gap must not be applied
+        self.assertEqual(self.trades, [])
+        self.assertTrue(wait_for(lambda: self.states[2:3] == [True]))
+
+    def test_malformed_update(self):
+        malformed = [148, 2, [['i', {}]]]
+        self.start([0., INIT], [0., malformed], IDLE)
+        self.assertTrue(wait_for(lambda: self.states[:2] == [True, False],
+                                 timeout=2.))
+        self.assertTrue(wait_for(lambda: self.states[2:3] == [True]))
+
+
+if __name__ == '__main__':
+    unittest.main()
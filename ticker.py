@@ -9,17 +9,18 @@ import time
 import argparse
 from pprint import pprint
 from datetime import datetime
-from urllib.request import urlopen
 from operator import mul
 from functools import reduce
 
+import http_transport
+
 URL = 'https://poloniex.com/public?command=returnTicker'
 BASE = {'BTC', 'ETH', 'XMR', 'USDT'}
 TIMESTAMP_FORMAT = '%Y.%m.%d-%H.%M.%S.json'
 
 
-def get_ticker() -> str:
-    json_data = urlopen(URL).read().decode()
+def fetch_ticker() -> str:
+    json_data = http_transport.shared().request(URL).decode()
     open('{:%Y.%m.%d-%H.%M.%S}.json'.format(datetime.now()), 'w').write(json_data)
     return json_data
 
@@ -62,7 +63,7 @@ def get_ticker(source: str) -> dict:
     graph = nx.DiGraph()
 
     in_data = json.loads(open(source).read() if source else
-                         get_ticker())
+                         fetch_ticker())
 
     graph.add_edges_from((*d.split('_'), in_data[d]) for d in sorted(in_data))
 
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+
+
+class TickerSnapshot:
+    ''' the last full ticker (one request for all markets) which all
+        market widgets and prices get fed from. Keeps track of the ticker
+        each market had when its trade history got fetched the last time,
+        so fetching can be skipped for markets which haven't moved. '''
+    def __init__(self, get_ticker):
+        ''' @get_ticker: e.g. mftl.px.PxApi.get_ticker, returning
+            {market: {'last': .., 'percentChange': .., 'baseVolume': ..}} '''
+        self._get_ticker = get_ticker
+        self._lock = threading.Lock()
+        self._ticker = {}
+        self._time = None
+        self._fetched = {}
+
+    def update(self):
+        ''' fetches the ticker and returns the markets which changed '''
+        ticker = {
+            m: (float(t['last']), float(t.get('percentChange', 0.)),
+                float(t.get('baseVolume', 0.)))
+            for m, t in self._get_ticker().items()}
+        with self._lock:
+            changed = {m for m, t in ticker.items() if self._ticker.get(m) != t}
+            self._ticker = ticker
+            self._time = time.time()
+        return changed
+
+    def time(self):
+        return self._time
+
+    def markets(self):
+        with self._lock:
+            return set(self._ticker)
+
+    def last(self, market):
+        with self._lock:
+            t = self._ticker.get(market)
+        return t[0] if t else None
+
+    def change(self, market):
+        ''' 24h change as a fraction '''
+        with self._lock:
+            t = self._ticker.get(market)
+        return t[1] if t else None
+
+    def btc_usd(self):
+        return self.last('USDT_BTC')
+
+    def state(self, market):
+        ''' the ticker of @market as to be passed to mark_fetched() '''
+        with self._lock:
+            return self._ticker.get(market)
+
+    def mark_fetched(self, market, state):
+        ''' @state: what state() returned before fetching '''
+        with self._lock:
+            self._fetched[market] = state
+
+    def moved(self, market):
+        ''' whether @market traded since mark_fetched() (as far as the ticker
+            tells) - markets we know nothing about always count as moved.
+            24h change and volume drift as the window rolls on, so only a
+            new last rate or a growing volume count. '''
+        with self._lock:
+            t = self._ticker.get(market)
+            fetched = self._fetched.get(market)
+        if t is None or fetched is None:
+            return True
+        last, _, volume = t
+        return last != fetched[0] or volume > fetched[2]
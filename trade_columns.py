@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+import numpy as np
+
+BUY, SELL = 1, -1
+
+FIELDS = (('time', np.float64),
+          ('rate', np.float64),
+          ('amount', np.float64),
+          ('total', np.float64),
+          ('side', np.int8))
+
+BUCKET_FIELDS = ('time', 'open', 'high', 'low', 'close', 'amount', 'total',
+                 'amount_buy', 'total_buy', 'amount_sell', 'total_sell',
+                 'count')
+
+
+class TradeColumns:
+    ''' trade history stored as one contiguous array per field instead of a
+        list of dicts. Columns written with save() can be loaded memory
+        mapped, so loading is (nearly) free and all accessors hand out
+        views rather than copies.
+        On disk each save() writes a new generation directory and then
+        switches the manifest to it, so readers never mix columns of
+        different generations. '''
+    def __init__(self, time, rate, amount, total, side):
+        self.time = time
+        self.rate = rate
+        self.amount = amount
+        self.total = total
+        self.side = side
+        self._buckets = {}
+
+    @staticmethod
+    def from_trades(trades):
+        ''' builds columns from a list of trade dicts like the ones
+            returned by TradeHistory.data() '''
+        n = len(trades)
+        columns = {name: np.empty(n, dtype) for name, dtype in FIELDS}
+        for i, t in enumerate(trades):
+            columns['time'][i] = t['time']
+            columns['amount'][i] = t['amount']
+            columns['total'][i] = t['total']
+            columns['rate'][i] = (
+                t['rate'] if 'rate' in t else t['total'] / t['amount'])
+            columns['side'][i] = BUY if t['type'] == 'buy' else SELL
+        return TradeColumns(**columns)
+
+    @staticmethod
+    def manifest(directory):
+        ''' returns {'generation', 'next', 'count', 'source'} of the columns
+            saved in @directory or None '''
+        try:
+            return json.loads(
+                open(os.path.join(directory, 'manifest.json')).read())
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def load(directory, mmap=True):
+        manifest = TradeColumns.manifest(directory)
+        if manifest is None:
+            raise FileNotFoundError('no columns in %r' % directory)
+        generation = os.path.join(directory, manifest['generation'])
+        return TradeColumns(**{
+            name: np.load(os.path.join(generation, '%s.npy' % name),
+                          mmap_mode='r' if mmap else None)
+            for name, _ in FIELDS})
+
+    def save(self, directory, source=None):
+        ''' @source identifies what the columns have been built from (see
+            manifest()) '''
+        old = TradeColumns.manifest(directory) or {'next': 0}
+        manifest = {'generation': 'gen-%06d' % old['next'],
+                    'next': old['next'] + 1,
+                    'count': len(self),
+                    'source': source}
+        generation = os.path.join(directory, manifest['generation'])
+        os.makedirs(generation, exist_ok=True)
+        for name, _ in FIELDS:
+            with open(os.path.join(generation, '%s.npy' % name), 'wb') as f:
+                np.save(f, getattr(self, name))
+                f.flush()
+                os.fsync(f.fileno())
+        tmp_file = os.path.join(directory, 'manifest.json.tmp')
+        with open(tmp_file, 'w') as f:
+            f.write(json.dumps(manifest))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, os.path.join(directory, 'manifest.json'))
+        # keep the previous generation for readers which have just read
+        # the old manifest
+        keep = {manifest['generation'], old.get('generation')}
+        for d in os.listdir(directory):
+            if d.startswith('gen-') and d not in keep:
+                shutil.rmtree(os.path.join(directory, d), ignore_errors=True)
+
+    def __len__(self):
+        return len(self.time)
+
+    def count(self):
+        return len(self.time)
+
+    def get_duration(self):
+        return float(self.time[-1] - self.time[0]) if len(self) else 0.
+
+    def index(self, t):
+        return int(np.searchsorted(self.time, t))
+
+    def slice(self, t_from=None, t_to=None):
+        ''' returns a view on all trades in [@t_from, @t_to] '''
+        i = 0 if t_from is None else self.index(t_from)
+        j = (len(self) if t_to is None else
+             int(np.searchsorted(self.time, t_to, side='right')))
+        return TradeColumns(*(getattr(self, name)[i:j] for name, _ in FIELDS))
+
+    def buys(self):
+        return self.side == BUY
+
+    def sells(self):
+        return self.side == SELL
+
+    def buckets(self, interval):
+        ''' returns the trades aggregated to @interval seconds. Results are
+            cached and coarser resolutions are built from a cached finer
+            one (if it divides @interval) rather than from the raw trades '''
+        if interval not in self._buckets:
+            finer = [i for i in self._buckets if interval % i == 0]
+            self._buckets[interval] = (
+                self._buckets[max(finer)].aggregate(interval) if finer else
+                Buckets.from_trades(self, interval))
+        return self._buckets[interval]
+
+
+class Buckets:
+    ''' OHLCV buckets with separate buy and sell volumes, one array per
+        column (see BUCKET_FIELDS) '''
+    def __init__(self, interval, **columns):
+        self.interval = interval
+        for name in BUCKET_FIELDS:
+            setattr(self, name, columns[name])
+
+    @staticmethod
+    def from_trades(trades, interval):
+        buys = trades.side == BUY
+        return Buckets._reduce(interval, {
+            'time': trades.time,
+            'open': trades.rate, 'high': trades.rate,
+            'low': trades.rate, 'close': trades.rate,
+            'amount': trades.amount, 'total': trades.total,
+            'amount_buy': np.where(buys, trades.amount, 0.),
+            'total_buy': np.where(buys, trades.total, 0.),
+            'amount_sell': np.where(buys, 0., trades.amount),
+            'total_sell': np.where(buys, 0., trades.total),
+            'count': np.ones(len(trades), np.int64)})
+
+    def aggregate(self, interval):
+        if interval % self.interval:
+            raise ValueError('cannot build %ds buckets from %ds buckets' % (
+                interval, self.interval))
+        return Buckets._reduce(interval, {
+            name: getattr(self, name) for name in BUCKET_FIELDS})
+
+    @staticmethod
+    def _reduce(interval, columns):
+        if not len(columns['time']):
+            return Buckets(interval, **columns)
+        keys = columns['time'] // interval
+        # trades are ordered by time - so each bucket is a contiguous range
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+        ends = np.append(starts[1:], len(keys))
+        result = {'time': keys[starts] * interval,
+                  'open': columns['open'][starts],
+                  'high': np.maximum.reduceat(columns['high'], starts),
+                  'low': np.minimum.reduceat(columns['low'], starts),
+                  'close': columns['close'][ends - 1]}
+        for name in ('amount', 'total', 'amount_buy', 'total_buy',
+                     'amount_sell', 'total_sell', 'count'):
+            result[name] = np.add.reduceat(columns[name], starts)
+        return Buckets(interval, **result)
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def rate(self):
+        ''' volume weighted average rate '''
+        return _ratio(self.total, self.amount)
+
+    @property
+    def rate_buy(self):
+        return _ratio(self.total_buy, self.amount_buy)
+
+    @property
+    def rate_sell(self):
+        return _ratio(self.total_sell, self.amount_sell)
+
+    def records(self):
+        ''' buckets as a list of dicts like mftl.expand_bucket() creates '''
+        columns = {name: getattr(self, name).tolist() for name in BUCKET_FIELDS}
+        columns['rate'] = self.rate.tolist()
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def _ratio(totals, amounts):
+    ''' totals / amounts with NaN for empty buckets '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return totals / amounts
@@ -6,12 +6,16 @@ import argparse
 import trader
 import time
 from trader_ui import show_gui
+import history_sync
+import http_transport
 
 
 def get_args() -> dict:
     parser = argparse.ArgumentParser(description='ticker')
     parser.add_argument("-v", "--verbose", action='store_true')
     parser.add_argument("-c", "--allow-cached", action='store_true')
+    parser.add_argument("--history-server",
+                        help='e.g. http://localhost:8080')
     parser.add_argument('cmd')
     parser.add_argument('arg1', nargs='?')
     parser.add_argument('arg2', nargs='?')
@@ -24,6 +28,8 @@ def main():
     args = get_args()
     log.basicConfig(level=log.DEBUG if args.verbose else log.INFO)
     trader.ALLOW_CACHED_VALUES = 'ALLOW' if args.allow_cached else 'NEVER'
+    http_transport.configure_cache(args.allow_cached)
+    http_transport.install()
     try:
         api = trader.Api(**ast.literal_eval(open('k').read()))
     except FileNotFoundError:
@@ -53,8 +59,10 @@ def main():
         show_gui()
     else:
         h = trader.TradeHistory('BTC_XMR', step_size_sec=60)
+        client = (history_sync.HistorySyncClient(args.history_server)
+                  if args.history_server else None)
         for i in range(2):
-            h.fetch_next()
+            history_sync.fetch_next(h, client)
             print(time.time() - h.last_time())
 
             print(h)
@@ -3,11 +3,12 @@
 import sys
 import os
 import signal
+import collections
+import concurrent.futures
 import ast
 import argparse
-import threading
-import queue
 import time
+import threading
 import traceback
 import logging as log
 from PyQt4 import QtGui, QtCore, Qt, uic
@@ -19,6 +20,19 @@ import mftl.util
 import mftl.px
 from mftl.util import json_mod
 from utils import toggle_profiling
+import history_sync
+import http_transport
+from indicators import HistoryVema
+import decimate
+from scheduler import TaskScheduler, AdaptiveRefresh
+from table_models import RowTableModel, LogListModel
+from order_journal import OrderJournal, trade_time
+from cost_basis import CostBasis
+from ticker_snapshot import TickerSnapshot
+from push_feed import PushFeed
+from history_store import merge_trades
+
+LOG_MAX_LINES = 5000
 
 
 class DataPlot(qwt.QwtPlot):
@@ -39,6 +53,8 @@ class DataPlot(qwt.QwtPlot):
         self._marker.setYValue(0.0)
         self._marker.attach(self)
 
+        self._pixel_width = 400
+
         self.enableAxis(qwt.QwtPlot.xBottom, False)
         self.enableAxis(qwt.QwtPlot.yLeft, True)
         # self.setAxisTitle(qwt.QwtPlot.xBottom, "Time (seconds)")
@@ -61,6 +77,14 @@ class DataPlot(qwt.QwtPlot):
                 scaleDraw.enableComponent(
                     qwt.QwtAbstractScaleDraw.Backbone, False)
 
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._pixel_width = max(1, self.canvas().width())
+
+    def pixel_width(self):
+        # read from worker threads - so it's just a cached int
+        return self._pixel_width
+
     def set_data(self, datax, datay):
         self._curve_rates.setData(datax, datay)
 
@@ -92,45 +116,122 @@ class MarketWidgetItem(QtGui.QListWidgetItem):
         self.setBackground(QtGui.QBrush(color, QtCore.Qt.SolidPattern))
 
 
-class MarketWidget(QtGui.QWidget):
+# parse market.ui only once rather than for each market
+MarketUi, _ = uic.loadUiType(
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), 'market.ui'))
+
+
+class MarketWidget(QtGui.QWidget, MarketUi):
 
     updated = QtCore.pyqtSignal()
 
-    def __init__(self, trade_history, api):
+    def __init__(self, trade_history, api, history_client=None):
         super().__init__()
-        uic.loadUi(os.path.join(os.path.dirname(__file__), 'market.ui'), self)
+        self.setupUi(self)
 
         self._trade_history = trade_history
         self._trader_api = api
+        self._history_client = history_client
+        self._vema = HistoryVema(trade_history, 0.005)
         self._list_item = None
 
         self._current_vema_rate = 0.
         self._current_trend = 0.
         self.lbl_market.setText(self._trade_history.name())
         self.lbl_currencies.setText(self._trade_history.friendly_name())
-        self._plot = DataPlot()
+        # the plot gets created when we're painted the first time (i.e. when
+        # we get visible) and the history is loaded by the first update
+        self._plot = None
+        self._plot_data = None
+        self._loaded = False
+        self._dirty = False
+        # trades from the push feed wait here for the next update - and
+        # until we've fetched the gap since the feed (re)connected
+        self._pushed = collections.deque()
+        self._synced_session = None
+        self._update_lock = threading.Lock()
         self._history_length = 100
         self._marker_value = None
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self._plot is None:
+            # don't change the layout while painting
+            self._plot = False
+            QtCore.QTimer.singleShot(0, self._create_plot)
+
+    def _create_plot(self):
+        self._plot = DataPlot()
         self.frm_main.layout().addWidget(self._plot)
-        self._trade_history.load()
+        if self._marker_value is not None:
+            self._plot.set_marker(self._marker_value)
+        if self._plot_data:
+            self._show_plot_data()
+
+    def pixel_width(self):
+        return self._plot.pixel_width() if self._plot else 400
+
+    def synced(self, session):
+        ''' whether we've fetched trades since push feed @session started '''
+        return session is not None and self._synced_session == session
+
+    def push_trades(self, trades, session):
+        ''' buffers @trades and returns whether they can be applied already
+            (see threadsafe_update_plot()) '''
+        self._pushed.extend(trades)
+        return self.synced(session)
+
+    def _apply_pushed(self):
+        trades = []
+        while self._pushed:
+            trades.append(self._pushed.popleft())
+        # polled and pushed trades overlap - merge_trades() drops doubles
+        return merge_trades(self._trade_history, trades) > 0
+
+    def threadsafe_update_plot(self, fetch=True, session=None):
+        ''' (if @fetch) polls for new trades and adds pushed ones. Pushed
+            trades are held back until a fetch since the feed's @session
+            started has succeeded - fetching starts at the last trade we
+            have, so applying them first would skip the gap. '''
+        # pushed and polled updates may run on different workers
+        with self._update_lock:
+            if not self._loaded:
+                self._trade_history.load()
+                self._loaded = True
+            changed = False
+            if fetch:
+                log.info('update market trades for %r', self._trade_history.name())
+                changed = history_sync.fetch_next(
+                    self._trade_history, self._history_client,
+                    api=self._trader_api)
+                self._synced_session = session
+            if self.synced(session):
+                changed = self._apply_pushed() or changed
+            if not changed:
+                return
+            self._dirty = True
+            self._update_plot_data()
 
-    def threadsafe_update_plot(self):
-        log.info('update market trades for %r', self._trade_history.name())
-        if not self._trade_history.fetch_next(api=self._trader_api):
-            return
-        times, rates = self._trade_history.get_plot_data(0.005)
+    def _update_plot_data(self):
+        times, rates = self._vema.update()
         if not times:
             return
+        # there is no need to plot more points than we have pixels, so
+        # reduce and scan the data here rather than on the GUI thread
+        mins, maxs = min(rates), max(rates)
+        times, rates = decimate.lttb(times, rates, self.pixel_width())
         QtCore.QMetaObject.invokeMethod(
             self, "_set_data", QtCore.Qt.QueuedConnection,
-            QtCore.Q_ARG(list, times),
-            QtCore.Q_ARG(list, rates))
+            QtCore.Q_ARG(object, times),
+            QtCore.Q_ARG(object, rates),
+            QtCore.Q_ARG(float, mins),
+            QtCore.Q_ARG(float, maxs))
 
     def trend(self):
         return self._current_trend
 
-    @QtCore.pyqtSlot(list, list)
-    def _set_data(self, times, rates_av):
+    @QtCore.pyqtSlot(object, object, float, float)
+    def _set_data(self, times, rates_av, mins, maxs):
         self._current_vema_rate = rates_av[-1]
         self._current_trend = rates_av[-1] / rates_av[0] - 1.
         self.lbl_rate_vema.setText('%.9f' % self._current_vema_rate)
@@ -139,27 +240,49 @@ class MarketWidget(QtGui.QWidget):
         self.lbl_age.setText('%ds' % (time.time() - self._trade_history.last_time()))
         self.lbl_trend.setText('%.2f%%' % (100 * self._current_trend))
 
+        self._plot_data = (times, rates_av, mins, maxs)
+        if self._plot:
+            self._show_plot_data()
+        self.updated.emit()
+
+    def _show_plot_data(self):
+        times, rates_av, mins, maxs = self._plot_data
         self._plot.set_data(times, rates_av)
-        mins, maxs = min(rates_av), max(rates_av)
         if self._marker_value:
             maxs = max(maxs, self._marker_value)
             mins = min(mins, self._marker_value)
         self._plot.setAxisScale(qwt.QwtPlot.yLeft, min(mins, maxs * 0.9), maxs)
         self.redraw()
-        self.updated.emit()
 
     def redraw(self):
+        if not self._plot: return
         self._plot.redraw()
 
     def set_marker(self, value):
         self._marker_value = value
+        if not self._plot: return
         self._plot.set_marker(self._marker_value)
 
+    def set_ticker(self, last, change):
+        self.lbl_rate.setText('%.9f' % last)
+        self.lbl_rate.setToolTip('24h: %+.2f%%' % (100 * change))
+
     def current_rate(self):
         return self._current_vema_rate
 
+    def market(self):
+        return self._trade_history.name()
+
+    def trade_history(self):
+        return self._trade_history
+
     def shutdown(self):
+        ''' saves the trade history if it has changed since loading and
+            returns whether it did '''
+        if not self._dirty: return False
         self._trade_history.save()
+        self._dirty = False
+        return True
 
     def set_list_item(self, item):
         # workaround! see https://stackoverflow.com/questions/44668016
@@ -180,30 +303,29 @@ class Priorities(IntEnum):
 
 
 class Trader(QtGui.QMainWindow):
-    class Task:
-        def __init__(self, fn, priority, retry: bool):
-            self.fn = fn
-            self.priority = priority
-            self.retry = retry
-
-        def __lt__(self, other):
-            return self.priority < other.priority
-
     def __init__(self):
         class LogHandler(log.Handler):
-            def __init__(self, parent):
+            # only buffers messages - the GUI fetches them at a fixed rate
+            # rather than getting woken up for each record
+            def __init__(self, capacity):
                 super().__init__()
-                self._parent = parent
+                self._messages = collections.deque(maxlen=capacity)
 
             def emit(self, record):
-                QtCore.QMetaObject.invokeMethod(
-                    self._parent, "_log_message",
-                    QtCore.Qt.QueuedConnection,
-                    QtCore.Q_ARG(dict, record.__dict__),
-                )
+                try:
+                    self._messages.append(self.format(record))
+                except Exception:
+                    self.handleError(record)
+
+            def take(self):
+                result = []
+                while self._messages:
+                    result.append(self._messages.popleft())
+                return result
 
         QtGui.QMainWindow.__init__(self)
-        log.getLogger().addHandler(LogHandler(self))
+        self._log_handler = LogHandler(LOG_MAX_LINES)
+        log.getLogger().addHandler(self._log_handler)
 
         self.setMouseTracking(True)
         self._directory = os.path.dirname(os.path.realpath(__file__))
@@ -211,25 +333,81 @@ class Trader(QtGui.QMainWindow):
         self._config = self._load_config('config')
         if 'proxies' in self._config:
             mftl.util.set_proxies(self._config['proxies'])
+            http_transport.shared().set_proxies(self._config['proxies'])
+            # set_proxies() has installed its own opener
+            http_transport.install()
 
         self._trader_api = self._get_trader()
+        # private calls get signed with an increasing nonce - two of them
+        # running at once could reach the exchange out of order
+        self._private_lock = threading.Lock()
+        self._history_client = (
+            history_sync.HistorySyncClient(self._config['history_server'])
+            if self._config['history_server'] else None)
         self._data = mftl.TraderData()
+        # placed orders and executed trades get appended to journals rather
+        # than rewriting a whole file each time
+        self._orders = OrderJournal('orders.jsonl', legacy_filename='orders')
+        self._trades = OrderJournal(
+            'trades.jsonl',
+            key=lambda t: (t['market'], t.get('globalTradeID', t.get('tradeID'))))
+        # cost, gain and last buy rates get updated with each new trade
+        # rather than recomputed from the whole history
+        self._cost_basis = CostBasis(self._config['cost_basis'])
+        self._cost_basis.update(self._trades.entries())
         self._balances_dirty = True
         self._markets = {}
+        self._primary_markets = set()
+        # one ticker request per cycle feeds all markets and prices
+        self._ticker = TickerSnapshot(mftl.px.PxApi.get_ticker)
+        self._fiat_rate_time = 0.
 
         self._update_timer = QtCore.QTimer(self)
         self._update_timer.timeout.connect(self._update_timer_timeout)
         self._update_timer.setInterval(self._config['update_interval_sec'] * 1000)
         self._update_timer.start()
 
+        self._log_model = LogListModel(LOG_MAX_LINES, self)
+        self.lst_log.setModel(self._log_model)
+        log_timer = QtCore.QTimer(self)
+        log_timer.timeout.connect(self._log_timer_timeout)
+        log_timer.setInterval(100)
+        log_timer.start()
+
         time_info_timer = QtCore.QTimer(self)
         time_info_timer.timeout.connect(self._time_info_timer_timeout)
         time_info_timer.setInterval(1000)
         time_info_timer.start()
 
-        self._worker_thread = threading.Thread(target=self._worker_thread_fn)
-        self._tasks = queue.PriorityQueue()
-        self._worker_thread.start()
+        # orders and cancellations get a lane of their own so they never
+        # have to wait for (possibly many) market updates
+        self._scheduler = TaskScheduler({
+            'orders': 1,
+            'data': 1,
+            'markets': self._config['market_workers']})
+        # markets get polled according to their activity, not on a fixed
+        # interval
+        self._refresh = AdaptiveRefresh(
+            budget=self._config['market_refresh_budget_per_min'] / 60,
+            min_interval=self._config['min_refresh_sec'],
+            max_interval=self._config['max_refresh_sec'])
+        market_timer = QtCore.QTimer(self)
+        market_timer.timeout.connect(self._market_timer_timeout)
+        market_timer.setInterval(5000)
+        market_timer.start()
+        # trades get pushed as they happen if we can - polling is the
+        # fallback while the feed is down
+        self._feed = None
+        if self._config['push_feed']:
+            self._feed = PushFeed(
+                self._config['push_feed'],
+                on_trades=self._threadsafe_on_trades,
+                on_state=self._threadsafe_on_feed_state)
+            self._feed.start()
+        ticker_timer = QtCore.QTimer(self)
+        ticker_timer.timeout.connect(self._ticker_timer_timeout)
+        ticker_timer.setInterval(self._config['ticker_interval_sec'] * 1000)
+        ticker_timer.start()
 
         self.pb_check.clicked.connect(self._pb_check_clicked)
         self.pb_place_order.clicked.connect(self._pb_place_order_clicked)
@@ -241,22 +419,35 @@ class Trader(QtGui.QMainWindow):
         self.pb_profile.clicked.connect(self._pb_profile_clicked)
         self.pb_stacktrace.clicked.connect(self._pb_stacktrace_clicked)
 
-        def setup_table(widget):
-            for i in range(widget.columnCount()):
+        def setup_table(widget, model):
+            widget.setModel(model)
+            for i in range(model.columnCount()):
                 widget.horizontalHeader().setResizeMode(
                     i, QtGui.QHeaderView.ResizeToContents)
 
+        order_columns = [('date', '%s'), ('market', '%s'), ('type', '%s'),
+                         ('amount', '%.8f'), ('prim cost', '%.8f'),
+                         ('rate', '%.8f'), ('orderNr', '%s')]
+        self._balances_model = RowTableModel(
+            [('currency', '%s'), ('amount', '%10.5f'), ('cost', '%10.5f'),
+             ('gain', '%10.1f%%'), ('BTC rate', '%13.8f'), ('~BTC', '%10.5f'),
+             ('~EUR', '%10.5f')], self)
+        self._open_orders_model = RowTableModel(
+            order_columns + [('cancel', '%s')], self)
+        self._order_history_model = RowTableModel(order_columns, self)
+
+        setup_table(self.tbl_balances, self._balances_model)
+        setup_table(self.tbl_open_orders, self._open_orders_model)
+        setup_table(self.tbl_order_history, self._order_history_model)
+        self.tbl_open_orders.clicked.connect(self._tbl_open_orders_clicked)
+
         # sort by time
-        self.tbl_order_history.sortItems(0, QtCore.Qt.DescendingOrder)
+        self.tbl_order_history.sortByColumn(0, QtCore.Qt.DescendingOrder)
         # sort by EUR value
-        self.tbl_balances.sortItems(6, QtCore.Qt.DescendingOrder)
-        self.tbl_open_orders.sortItems(2, QtCore.Qt.DescendingOrder)
+        self.tbl_balances.sortByColumn(6, QtCore.Qt.DescendingOrder)
+        self.tbl_open_orders.sortByColumn(2, QtCore.Qt.DescendingOrder)
         self.le_suggested_rate_factor.setText(str(self._config['suggested_rate_factor']))
 
-        setup_table(self.tbl_balances)
-        setup_table(self.tbl_open_orders)
-        setup_table(self.tbl_order_history)
-
         self._add_market('USDT_BTC', self.lst_primary_coins)
         for m in self._config['markets']:
             self._add_market(m, self.lst_markets)
@@ -264,31 +455,54 @@ class Trader(QtGui.QMainWindow):
         self.show()
 
         self._update_values()
+        self._market_timer_timeout()
 
     def _update_values(self):
-        if not self._tasks.empty():
-            log.warning("task not done yet - I'll come back later")
-            return
-
+        # tasks which are still pending are not enqueued twice, so there is
+        # no need to skip a whole cycle if some market takes longer
         if not self._data.available_markets():
             # todo: update
-            self._put_task(self._threadsafe_fetch_markets, Priorities.Init)
+            self._put_task(self._threadsafe_fetch_markets, Priorities.Init,
+                           key='markets')
 
         if (not self._data.trade_history() or
             not self._data.balances() or
                 self._balances_dirty):
             self._balances_dirty = False
-            self._put_task(self._threadsafe_fetch_orders, Priorities.Balances)
-            self._put_task(self._threadsafe_fetch_balances, Priorities.Balances)
-
-        for _, w in self._markets.items():
-            self._put_task(w.threadsafe_update_plot, Priorities.Low)
+            self._put_fetch_tasks(Priorities.Balances)
+
+    def _update_markets(self, markets):
+        for m in markets:
+            self._put_task(
+                lambda w=self._markets[m]: self._threadsafe_update_market(w),
+                Priorities.Low, key=('update', m))
+
+    def _threadsafe_update_market(self, market_widget):
+        # taken before fetching - so trades coming in meanwhile count as a
+        # move, but only marked once the fetch has succeeded
+        state = self._ticker.state(market_widget.market())
+        # taken before fetching, too - a reconnect meanwhile needs another
+        # fetch
+        session = self._feed.session() if self._feed else None
+        market_widget.threadsafe_update_plot(session=session)
+        self._ticker.mark_fetched(market_widget.market(), state)
+        self._refresh.observe(
+            market_widget.market(), market_widget.trade_history())
 
     def _load_config(self, filename):
         result = {'graph_height':   140,
                   'history_length_h': 4,
                   'update_interval_sec': 180,
+                  'market_workers': 4,
+                  'market_refresh_budget_per_min': 20,
+                  'min_refresh_sec': 20,
+                  'max_refresh_sec': 1800,
+                  'ticker_interval_sec': 10,
+                  'fiat_rate_interval_sec': 3600,
                   'suggested_rate_factor': 1.0,
+                  'history_server': None,  # e.g. 'http://localhost:8080'
+                  'push_feed': None,  # e.g. 'wss://api2.poloniex.com'
+                  'cost_basis': 'fifo',  # or 'average'
                   'markets': (
                       'BTC_ETC', # 'Ethereum Classic
                       #'BTC_XMR', #'Monero
@@ -306,16 +520,17 @@ class Trader(QtGui.QMainWindow):
             log.warning('did not find key file - only public access is possible')
             return None
 
-    @QtCore.pyqtSlot(dict)
-    def _log_message(self, record):
-        self.lst_log.addItem(
-            record['message'] if 'message' in record else record['msg'])
+    def _log_timer_timeout(self):
+        messages = self._log_handler.take()
+        if not messages: return
+        self._log_model.append(messages)
         self.lst_log.scrollToBottom()
 
     def closeEvent(self, _):
         log.info('got close event, wait for worker to finish..')
-        self._put_task(None, Priorities.Critical)
-        self._worker_thread.join()
+        if self._feed:
+            self._feed.stop()
+        self._scheduler.shutdown()
         t1 = time.time()
         self._persist()
         log.info('saving trade history took %.2fs', time.time() - t1)
@@ -326,45 +541,96 @@ class Trader(QtGui.QMainWindow):
         self._handle_order_data()
 
     def _persist(self):
-        for _, m in self._markets.items():
-            m.shutdown()
-
-    def _put_task(self, fn, priority, retry=True):
-        self._tasks.put(Trader.Task(fn, priority, retry))
-
-    def _worker_thread_fn(self):
-        def multiple_try(fn, times):
-            for _ in range(times):
+        def save(market):
+            t1 = time.time()
+            return market, self._markets[market].shutdown(), time.time() - t1
+
+        # serialising to JSON holds the GIL - only the writing and syncing
+        # of the files overlap, which still helps with many markets
+        with concurrent.futures.ThreadPoolExecutor(
+                self._config['market_workers']) as pool:
+            futures = {pool.submit(save, m): m for m in self._markets}
+            for f in concurrent.futures.as_completed(futures):
                 try:
-                    fn()
-                    return
+                    market, saved, duration = f.result()
                 except Exception as exc:
-                    traceback.print_exc()
-                    log.warning('Exception in worker thread: %r', exc)
-            raise Exception()
-
-        while True:
-            task = self._tasks.get()
-            if task.fn is None:
-                log.info('exit _worker_thread_fn()')
-                return
-            log.debug('got new task..')
-            try:
-                multiple_try(task.fn, 3 if task.retry else 1)
-            except Exception as exc:
-                log.error('giving up trying to call %r', task.fn)
-                return
+                    log.error('could not save trade history of %r: %r',
+                              futures[f], exc)
+                    continue
+                if saved:
+                    log.info('saved trade history of %r in %.2fs',
+                             market, duration)
+                else:
+                    log.info('trade history of %r unchanged', market)
+
+    def _put_task(self, fn, priority, retry=True, key=None, lane=None):
+        lane = lane or ('orders' if priority <= Priorities.Order else
+                        'data' if priority <= Priorities.Balances else
+                        'markets')
+        return self._scheduler.put(fn, priority, lane, retry, key)
+
+    def _put_fetch_tasks(self, priority):
+        # keyed, so bursts of clicks/results result in one fetch each -
+        # urgent or not, fetching must not hold up the orders lane
+        self._put_task(self._threadsafe_fetch_orders, priority, key='orders',
+                       lane='data')
+        self._put_task(self._threadsafe_fetch_balances, priority,
+                       key='balances', lane='data')
 
     def _update_timer_timeout(self):
-        if not self._worker_thread.is_alive(): return
+        if not self._scheduler.is_alive(): return
         log.info('trigger updates')
         self._update_values()
 
+    def _market_timer_timeout(self):
+        if not self._scheduler.is_alive(): return
+        due = self._refresh.due()
+        # no need to fetch trades if the ticker didn't move or if they get
+        # pushed to us anyway
+        session = self._feed.session() if self._feed else None
+        live = {m for m in (self._feed.markets() if session else ())
+                if m in self._markets and self._markets[m].synced(session)}
+        markets = [m for m in due if m not in live and self._ticker.moved(m)]
+        if len(markets) < len(due):
+            log.debug('skip %d unchanged markets', len(due) - len(markets))
+        self._update_markets(markets)
+
+    def _threadsafe_on_trades(self, market, trades):
+        market_widget = self._markets.get(market)
+        if not market_widget: return
+        session = self._feed.session()
+        if not market_widget.push_trades(trades, session):
+            # they get applied after the fetch filling the gap
+            return
+        self._put_task(
+            lambda: market_widget.threadsafe_update_plot(
+                fetch=False, session=session),
+            Priorities.Low, key=('push', market))
+
+    def _threadsafe_on_feed_state(self, connected):
+        QtCore.QMetaObject.invokeMethod(
+            self, "_handle_feed_state", QtCore.Qt.QueuedConnection,
+            QtCore.Q_ARG(bool, connected))
+
+    @QtCore.pyqtSlot(bool)
+    def _handle_feed_state(self, connected):
+        log.info('push feed %s', 'connected' if connected else
+                 'disconnected - poll markets meanwhile')
+        if connected:
+            # fill the gap since the feed went down (or since startup)
+            self._update_markets(list(self._markets))
+
+    def _ticker_timer_timeout(self):
+        if not self._scheduler.is_alive(): return
+        self._put_task(self._threadsafe_fetch_ticker, Priorities.Balances,
+                       key='ticker')
+
     def _time_info_timer_timeout(self):
-        self.lbl_last_update.setText('%d' % self._tasks.qsize())
+        self.lbl_last_update.setText('%d' % self._scheduler.qsize())
 
     def _pb_refresh_clicked(self):
         self._update_values()
+        self._update_markets(self._markets)
 
     def _pb_stacktrace_clicked(self):
         import faulthandler
@@ -375,8 +641,7 @@ class Trader(QtGui.QMainWindow):
         toggle_profiling(clock_type='cpu')
 
     def _pb_update_balances_clicked(self):
-        self._put_task(self._threadsafe_fetch_orders, Priorities.Balances)
-        self._put_task(self._threadsafe_fetch_balances, Priorities.Balances)
+        self._put_fetch_tasks(Priorities.Balances)
 
     def _pb_check_clicked(self):
         self.pb_place_order.setEnabled(False)
@@ -416,35 +681,30 @@ class Trader(QtGui.QMainWindow):
     def _threadsafe_place_order(self, order):
         log.info('place order: %r', order)
         try:
-            result = self._trader_api.place_order(
-                market=order['market'],
-                action=order['action'],
-                rate=order['rate'],
-                amount=order['amount'])
+            with self._private_lock:
+                result = self._trader_api.place_order(
+                    market=order['market'],
+                    action=order['action'],
+                    rate=order['rate'],
+                    amount=order['amount'])
         except (RuntimeError, ValueError) as exc:
             log.error('cannot place order: %s', exc)
             return
 
-        result.update({'speed_factor': order['speed_factor'],
+        result.update({'market': order['market'],
+                       'action': order['action'],
+                       'rate': order['rate'],
+                       'amount': order['amount'],
+                       'speed_factor': order['speed_factor'],
                        'time': time.time()})
+        self._orders.append(result)
         QtCore.QMetaObject.invokeMethod(
             self, "_handle_order_result", QtCore.Qt.QueuedConnection,
             QtCore.Q_ARG(dict, result))
 
     @QtCore.pyqtSlot(dict)
     def _handle_order_result(self, order_result):
-        def save_order(order):
-            if not order: return
-            try:
-                orders = json_mod.loads(open('orders').read())
-            except FileNotFoundError:
-                orders = []
-            orders.append(order)
-            open('orders', 'w').write(json_mod.dumps(orders))
-
-        save_order(order_result)
-        self._put_task(self._threadsafe_fetch_orders, Priorities.Critical)
-        self._put_task(self._threadsafe_fetch_balances, Priorities.Critical)
+        self._put_fetch_tasks(Priorities.Critical)
         self._balances_dirty = True
 
     def _le_trade_amount_textChanged(self):
@@ -499,11 +759,38 @@ class Trader(QtGui.QMainWindow):
                 open('last_markets', 'w').write(
                     json_mod.dumps(list(self._data.available_markets())))
 
+    def _threadsafe_fetch_ticker(self):
+        changed = self._ticker.update()
+        log.debug('ticker: %d markets changed', len(changed))
+        QtCore.QMetaObject.invokeMethod(
+            self, "_handle_ticker", QtCore.Qt.QueuedConnection,
+            QtCore.Q_ARG(object, changed))
+
+    @QtCore.pyqtSlot(object)
+    def _handle_ticker(self, changed):
+        for m in changed & set(self._markets):
+            self._markets[m].set_ticker(
+                self._ticker.last(m), self._ticker.change(m))
+
+    def _btc_prices(self):
+        ''' returns BTC/USD from the last ticker and BTC/EUR derived from it
+            with the (slowly moving) EUR/USD ratio of the last full update '''
+        usd, eur = self._data.btc_usd_price(), self._data.btc_eur_price()
+        ticker_usd = self._ticker.btc_usd()
+        if ticker_usd and usd:
+            return ticker_usd, ticker_usd * eur / usd
+        return usd, eur
+
     def _threadsafe_fetch_balances(self):
         if not self._trader_api: return
         log.info("update balances..")
-        self._data.update_btc_usd_rate()
-        self._data.update_balances(self._trader_api)
+        # BTC/USD comes with the ticker - other rates are needed rarely
+        if (not self._ticker.btc_usd() or time.time() - self._fiat_rate_time >
+                self._config['fiat_rate_interval_sec']):
+            self._data.update_btc_usd_rate()
+            self._fiat_rate_time = time.time()
+        with self._private_lock:
+            self._data.update_balances(self._trader_api)
         QtCore.QMetaObject.invokeMethod(
             self, "_handle_balance_data", QtCore.Qt.QueuedConnection)
 
@@ -512,6 +799,9 @@ class Trader(QtGui.QMainWindow):
         self._market_data_updated()
 
     def _display_balances(self):
+        # coins we've sold completely drop back to the normal weight
+        for m in self._markets:
+            self._refresh.set_weight(m, self._market_weight(m))
         if not self._data.balances(): return
         log.info('display balances')
 
@@ -521,13 +811,10 @@ class Trader(QtGui.QMainWindow):
 
         self._set_cb_items(self.cb_trade_curr_sell, self._data.balances().keys())
 
-        self.tbl_balances.setSortingEnabled(False)
-        self.tbl_balances.setRowCount(len(self._data.balances()))
-
-        xbt_usd_rate = self._data.btc_usd_price()
+        xbt_usd_rate, xbt_eur_rate = self._btc_prices()
         btc_total = 0.
         eur_total = 0.
-        i = 0
+        rows = {}
         for c, a in self._data.balances().items():
             market = 'BTC_%s' % c
             try:
@@ -539,105 +826,103 @@ class Trader(QtGui.QMainWindow):
                 self._markets[market].current_rate() if market in self._markets else
                 0.)
             _add_btc = a * _btc_rate
-            _add_eur = _add_btc * self._data.btc_eur_price()
+            _add_eur = _add_btc * xbt_eur_rate
             btc_total += _add_btc
             eur_total += _add_eur
-            cost = self._data.get_asset_cost(c)
+            cost = self._cost_basis.cost(market)
             gain = 100 * (_add_btc / cost - 1) if cost else 0
-            self.tbl_balances.setItem(i, 0, QtGui.QTableWidgetItem('%s' % c))
-            self.tbl_balances.setItem(i, 1, QtGui.QTableWidgetItem('%10.5f' % a))
-            self.tbl_balances.setItem(i, 2, QtGui.QTableWidgetItem('%10.5f' % cost))
-            self.tbl_balances.setItem(i, 3, QtGui.QTableWidgetItem('%10.1f%%' % gain))
-
-            self.tbl_balances.setItem(i, 4, QtGui.QTableWidgetItem('%13.8f' % _btc_rate))
-            self.tbl_balances.setItem(i, 5, QtGui.QTableWidgetItem('%10.5f' % _add_btc))
-            self.tbl_balances.setItem(i, 6, QtGui.QTableWidgetItem('%10.5f' % _add_eur))
-            i += 1
-        self.tbl_balances.setSortingEnabled(True)
+            rows[c] = (c, a, cost, gain, _btc_rate, _add_btc, _add_eur)
+        self._balances_model.set_rows(rows)
 
         self.lbl_XBT_USD.setText('%.2f' % xbt_usd_rate)
-        self.lbl_XBT_EUR.setText('%.2f' % self._data.btc_eur_price())
+        self.lbl_XBT_EUR.setText('%.2f' % xbt_eur_rate)
         self.lbl_bal_BTC.setText('%.4f' % btc_total)
         self.lbl_bal_EUR.setText('%.4f' % eur_total)
 
     def _threadsafe_fetch_orders(self):
         if not self._trader_api: return
         log.info('update trades/open orders')
-        self._data.update_trade_history(self._trader_api)
-        self._data.update_open_orders(self._trader_api)
+        with self._private_lock:
+            self._data.update_trade_history(self._trader_api)
+        added = self._trades.extend(
+            dict(t, market=m, time=trade_time(t))
+            for m, history in self._data.trade_history().items()
+            for t in history)
+        log.info('%d new trades in journal', len(added))
+        self._cost_basis.update(added, self._trades)
+        with self._private_lock:
+            self._data.update_open_orders(self._trader_api)
         QtCore.QMetaObject.invokeMethod(
             self, "_handle_order_data", QtCore.Qt.QueuedConnection)
 
     @QtCore.pyqtSlot()
     def _handle_order_data(self):
         log.info('display trades/open orders')
-        self._fill_order_table(self.tbl_open_orders, self._data.open_orders(), cancel_button=True)
-        self._fill_order_table(self.tbl_order_history, self._data.trade_history())
-        for m, history in self._data.trade_history().items():
-            for h in history:
-                if h['type'] == 'buy' and m in self._markets:
-                    self._markets[m].set_marker(
-                        float(h['total']) / float(h['amount']))
-                    self._markets[m].redraw()
-                    break
+        self._fill_order_table(self._open_orders_model, self._data.open_orders(), cancel_button=True)
+        self._fill_order_table(self._order_history_model, self._trades.by_market())
+        for m in self._cost_basis.markets() & set(self._markets):
+            last_buy_rate = self._cost_basis.last_buy_rate(m)
+            if last_buy_rate:
+                self._markets[m].set_marker(last_buy_rate)
+                self._markets[m].redraw()
         if self._data.open_orders():
             self._balances_dirty = True
 
-    def _fill_order_table(self, table_widget, orders, cancel_button=False):
-        table_widget.setSortingEnabled(False)
-        table_widget.setRowCount(
-            sum(len(v) for k, v in orders.items()))
-        i = 0
+    def _fill_order_table(self, model, orders, cancel_button=False):
+        rows = {}
         for c, corder in orders.items():
             for order in corder:
-                table_widget.setItem(i, 0, QtGui.QTableWidgetItem(order['date']))
-                table_widget.setItem(i, 1, QtGui.QTableWidgetItem(c))
-                table_widget.setItem(i, 2, QtGui.QTableWidgetItem(order['type']))
-                table_widget.setItem(i, 3, QtGui.QTableWidgetItem('%.8f' % order['amount']))
-                table_widget.setItem(i, 4, QtGui.QTableWidgetItem('%.8f' % order['total']))
-                table_widget.setItem(i, 5, QtGui.QTableWidgetItem('%.8f' % order['rate']))
-                table_widget.setItem(i, 6, QtGui.QTableWidgetItem(str(order['orderNumber'])))
-
-                def cancel(ordernr):
-                    self._put_task(
-                        lambda o=ordernr: self._threadsafe_cancel_order(o),
-                        Priorities.Critical)
-
-                if cancel_button:
-                    btn = QtGui.QPushButton('X')
-                    btn.clicked.connect(
-                        lambda chk, v=order['orderNumber']: cancel(v))
-                    table_widget.setCellWidget(i, 7, btn)
-                i += 1
-        table_widget.setSortingEnabled(True)
+                rows[(c, order.get('tradeID'), order['orderNumber'])] = (
+                    order['date'], c, order['type'], order['amount'],
+                    order['total'], order['rate'], str(order['orderNumber'])
+                    ) + (('X',) if cancel_button else ())
+        model.set_rows(rows)
+
+    def _tbl_open_orders_clicked(self, index):
+        if index.column() != 7: return
+        order_nr = self._open_orders_model.key(index.row())[2]
+        self._put_task(
+            lambda: self._threadsafe_cancel_order(order_nr),
+            Priorities.Critical, key=('cancel', order_nr))
 
     def _threadsafe_cancel_order(self, order_nr):
         log.info('cancel order %r', order_nr)
+        with self._private_lock:
+            result = self._trader_api.cancel_order(order_nr)
         QtCore.QMetaObject.invokeMethod(
             self, "_handle_order_canceled", QtCore.Qt.QueuedConnection,
-            QtCore.Q_ARG(dict, self._trader_api.cancel_order(order_nr)),
+            QtCore.Q_ARG(dict, result),
         )
 
     @QtCore.pyqtSlot(dict)
     def _handle_order_canceled(self, result):
         log.info('cancel returned %r', result)
-        self._put_task(self._threadsafe_fetch_orders, Priorities.Critical)
-        self._put_task(self._threadsafe_fetch_balances, Priorities.Critical)
+        self._put_fetch_tasks(Priorities.Critical)
         self._balances_dirty = True
 
+    def _market_weight(self, market):
+        # primary coins and coins we have are more interesting
+        held = (self._data.balances() or {}).get(market.split('_')[1], 0.)
+        return 2. if market in self._primary_markets or held else 1.
+
     def _add_market(self, market, list_widget):
         if market in self._markets: return
         log.info('add market: %r', market)
 
         market_widget = MarketWidget(
             self._data.create_trade_history(market, max_duration=48*3600),
-            self._trader_api)
+            self._trader_api, self._history_client)
         market_widget_item = MarketWidgetItem(market_widget, list_widget)
         market_widget.updated.connect(self._market_data_updated)
         market_widget_item.set_height(self._config['graph_height'])
 
         market_widget._history_length = self._config['history_length_h'] * 3600
         self._markets[market] = market_widget
+        if self._feed:
+            self._feed.subscribe(market)
+        if list_widget is self.lst_primary_coins:
+            self._primary_markets.add(market)
+        self._refresh.add(market, weight=self._market_weight(market))
         list_widget.setMaximumHeight(
             list_widget.count() * (5 + self._config['graph_height']))
 
@@ -687,6 +972,8 @@ def main():
     log.addLevelName(log.NOTSET,   '(NA)')
 
     mftl.util.ALLOW_CACHED_VALUES = 'ALLOW' if args.allow_cached else 'NEVER'
+    http_transport.configure_cache(args.allow_cached)
+    http_transport.install()
 
     log.info('or run `kill -10 %d` to show stack trace', os.getpid())
     signal.signal(signal.SIGUSR1, handle_sigusr1)
@@ -3,43 +3,130 @@
 import logging as log
 import time
 import argparse
+import json
+import threading
+import email.utils
+import urllib.parse
 import http.server
-import socketserver
+import concurrent.futures
+import itertools
 
 import trader
+import http_transport
+from utils import RateLimiter, backoff, CRAWL
+from history_store import SegmentStore, bucket_trades, pack_trades, merge_trades
 
 
 class HistoryServer(http.server.BaseHTTPRequestHandler):
-    def __init__(self, request, client_address, server):
-        http.server.BaseHTTPRequestHandler.__init__(
-            self, request, client_address, server)
+    ''' read API for the crawled history:
+        GET /history                     => known markets
+        GET /history/BTC_XMR?from=&to=   => trades as JSON lines
+        GET /history/BTC_XMR?bucket=300  => OHLC buckets as JSON lines
+        GET /history/BTC_XMR?from=&format=binary => packed trade records
+    '''
+    protocol_version = 'HTTP/1.1'
+    # clients keep connections alive - don't let small chunks wait for ACKs
+    disable_nagle_algorithm = True
+    chunk_size = 64 * 1024
 
     def do_GET(self):
-        print(self.path)
-        if True:
-            self.send_response(200)
-            self.send_header('Content type', 'application/octet-stream')
-            self.send_header('Connection', 'close')
-            self.end_headers()
-            self.wfile.write(_archive.read())
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        path = url.path.strip('/').split('/')
+        stores = self.server.stores
+        if path == ['history']:
+            self._send_json([
+                {'market': m, 'count': s.count(),
+                 'first': s.first_time(), 'last': s.last_time()}
+                for m, s in sorted(stores.items())])
+        elif len(path) == 2 and path[0] == 'history' and path[1] in stores:
+            try:
+                t_from = float(query['from'][0]) if 'from' in query else None
+                t_to = float(query['to'][0]) if 'to' in query else None
+                bucket = int(query['bucket'][0]) if 'bucket' in query else None
+            except ValueError as exc:
+                self.send_error(400, str(exc))
+                return
+            binary = query.get('format') == ['binary']
+            if binary and bucket:
+                self.send_error(400, 'buckets are not available as binary')
+                return
+            self._send_history(
+                stores[path[1]], t_from, t_to, bucket, binary)
         else:
             self.send_error(404)
 
-    def do_POST(self):
-        print(self.path)
-        if True:
-            self.send_response(201)
-        else:
-            self.send_error(e.code, e.description)
+    def _not_modified(self, etag, last_modified):
+        if 'If-None-Match' in self.headers:
+            return self.headers['If-None-Match'] == etag
+        if 'If-Modified-Since' in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(
+                    self.headers['If-Modified-Since']).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(last_modified) <= since
+        return False
+
+    def _send_history(self, store, t_from, t_to, bucket, binary):
+        last_modified = store.last_modified()
+        etag = '"%s-%d-%s"' % (store.name(), store.count(), store.last_time())
+        if self._not_modified(etag, last_modified):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream' if binary
+                                         else 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified',
+                         email.utils.formatdate(last_modified, usegmt=True))
+        self.end_headers()
 
-        self.close_connection = True
+        records = store.trades(t_from, t_to)
+        if bucket:
+            records = bucket_trades(records, bucket)
+        chunk = []
+        size = 0
+        for r in records:
+            line = (pack_trades((r,)) if binary else
+                    (json.dumps(r) + '\n').encode())
+            chunk.append(line)
+            size += len(line)
+            if size >= self.chunk_size:
+                self._write_chunk(b''.join(chunk))
+                chunk, size = [], 0
+        if chunk:
+            self._write_chunk(b''.join(chunk))
+        self._write_chunk(b'')
+
+    def _write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def _send_json(self, data):
+        content = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
         self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, fmt, *args):
+        log.debug(fmt, *args)
 
 
-def start_server(port):
-    socketserver.TCPServer.allow_reuse_address = True
-    http_server = socketserver.TCPServer(('', port), HistoryServer)
-    http_server.serve_forever()
+def start_server(port, stores):
+    http.server.ThreadingHTTPServer.allow_reuse_address = True
+    http_server = http.server.ThreadingHTTPServer(('', port), HistoryServer)
+    http_server.daemon_threads = True
+    http_server.stores = stores
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    return http_server
 
 def init():
     result = {}
@@ -54,34 +141,74 @@ def init():
             step_size_sec=4*3600,
             history_max_duration=10*365*24*3600,
             update_threshold=5*3600)
-        result[m].load('server')
     return result
 
-def serve(interval):
 
-    # start_server(8080)
+def init_stores(markets):
+    ''' opens the stores and rebuilds the histories from them '''
+    result = {}
+    for m, th in markets.items():
+        store = result[m] = SegmentStore(m)
+        if not store.count():
+            # first run: import what we have from the last full snapshot
+            th.load('server')
+            store.save(th.data())
+            continue
+        merge_trades(th, store.trades())
+        print('%s: %d trades from store' % (m, th.count()))
+    return result
+
+
+def fetch_market(th, store, compact):
+    count_before = th.count()
+    tu = time.time()
+    def fetch():
+        # crawling must not get in the way of other requests
+        with http_transport.priority(CRAWL):
+            th.fetch_next(-1, only_old=True)
+
+    try:
+        backoff(fetch, errors=(trader.ServerError,), name=th.name())
+    except trader.ServerError as exc:
+        print('(WW) %s: %r' % (th.name(), exc))
+    store.save(th.data())
+    if compact:
+        # merge segments - compact() replaces them atomically
+        store.compact()
+    return th.count() - count_before, time.time() - tu
+
+
+def crawl(markets, stores, pool, compact=False):
+    futures = {pool.submit(fetch_market, th, stores[m], compact): m
+               for m, th in markets.items()}
+    for i, f in enumerate(concurrent.futures.as_completed(futures)):
+        th = markets[futures[f]]
+        try:
+            added, duration = f.result()
+        except Exception as exc:
+            print('(EE) [%d/%d] %s: %r' % (
+                i + 1, len(futures), th.name(), exc))
+            continue
+        print('[%d/%d] %s #%d(+%d)/%.2fh took %.1fsec' % (
+            i + 1, len(futures), th.name(), th.count(), added,
+            th.get_duration() / 3600, duration))
+
+
+def serve(interval, workers, rate, compact_interval, port):
+
     markets = init()
+    stores = init_stores(markets)
+    start_server(port, stores)
+    print('serving history on port %d' % port)
+    http_transport.shared().set_limiter(RateLimiter(rate, burst=workers))
     print('--')
-    while True:
-        t1 = time.time()
-        print('fetch..')
-        for m, th in markets.items():
-            print(m)
-            count_before = th.count()
-            tu = time.time()
-            for _ in range(3):
-                try:
-                    th.fetch_next(-1, only_old=True)
-                    break
-                except trader.ServerError as exc:
-                    print('(WW) %r' % exc)
-            print('#%d(+%d)/%.2fh took %.1fsec' % (
-                th.count(), th.count() - count_before,
-                th.get_duration() / 3600, time.time() - tu))
-            th.save('server')
-            time.sleep(0.2)
-        t2 = time.time()
-        print('update took %.1fs' % (t2 - t1))
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        for i in itertools.count(1):
+            t1 = time.time()
+            print('fetch..')
+            crawl(markets, stores, pool, compact=(i % compact_interval == 0))
+            t2 = time.time()
+            print('update took %.1fs' % (t2 - t1))
 
 
 
@@ -90,6 +217,13 @@ def get_args() -> dict:
 
     parser.add_argument("-v", "--verbose", action='store_true')
     parser.add_argument("-c", "--allow-cached", action='store_true')
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help='number of markets fetched at once')
+    parser.add_argument("-r", "--rate", type=float, default=5.,
+                        help='max number of requests per second (all markets)')
+    parser.add_argument("--compact-interval", type=int, default=50,
+                        help='merge history segments every N passes')
+    parser.add_argument("-p", "--port", type=int, default=8080)
     return parser.parse_args()
 
 
@@ -97,7 +231,10 @@ def main():
     args = get_args()
     log.basicConfig(level=log.DEBUG if args.verbose else log.INFO)
     trader.ALLOW_CACHED_VALUES = 'ALLOW' if args.allow_cached else 'NEVER'
-    serve(interval=5)
+    http_transport.configure_cache(args.allow_cached)
+    http_transport.install()
+    serve(interval=5, workers=args.workers, rate=args.rate,
+          compact_interval=args.compact_interval, port=args.port)
 
 
 if __name__ == '__main__':
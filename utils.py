@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 
 import time
+import heapq
+import random
+import itertools
+import threading
 import logging as log
 
 
@@ -50,3 +54,67 @@ def toggle_profiling(clock_type='wall') -> None:
                      3: ("ttot",  8),
                      4: ("scnt", 10)})
 
+
+
+# request classes of the shared rate limit - lower ones go first. Private
+# requests are signed with a nonce before they get here, so they all share
+# one class and keep their order.
+PRIVATE, MARKET, CRAWL = range(3)
+
+
+class RateLimiter:
+    ''' token bucket shared between threads: allows @rate requests per second
+        on average with bursts of up to @burst requests. Waiting callers
+        get served by @priority (lower first) and in order of arrival. '''
+    def __init__(self, rate: float, burst: int=1):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = time.time()
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+
+    def acquire(self, priority: int=0) -> None:
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.time()
+                    self._tokens = min(
+                        self._burst,
+                        self._tokens + (now - self._last) * self._rate)
+                    self._last = now
+                    if self._waiting[0] == ticket and self._tokens >= 1.:
+                        self._tokens -= 1.
+                        return
+                    self._cond.wait(
+                        max(0., (1. - self._tokens) / self._rate)
+                        if self._waiting[0] == ticket else None)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def waiting(self) -> int:
+        with self._cond:
+            return len(self._waiting)
+
+
+def backoff(fn, errors=(Exception,), tries=5, base=.5, cap=30.,
+            retry_if=None, name=None):
+    ''' calls @fn until it doesn't raise one of @errors (at most @tries
+        times), sleeping a random time of up to base * 2^n seconds (but
+        not more than @cap) in between ('full jitter') so many clients
+        don't retry in lockstep. @retry_if(exc) can veto a retry. '''
+    for i in itertools.count():
+        try:
+            return fn()
+        except errors as exc:
+            if i + 1 >= tries or (retry_if and not retry_if(exc)):
+                raise
+            wait = random.uniform(0., min(cap, base * 2 ** i))
+            log.warning('%s failed (%r) - retry in %.1fs',
+                        name or getattr(fn, '__qualname__', repr(fn)), exc, wait)
+            time.sleep(wait)